@@ -0,0 +1,188 @@
+from __future__ import print_function, division
+
+import sys
+
+import numpy
+
+# Deliberately does not import ROOT at module level: ROOT is only needed (and imported) when converting to or from TH1/TH2 objects.
+
+ZERO_TOLERANCE = 0.000001
+
+class tmArrayHistogram:
+    '''Histogram with up to two axes, stored as NumPy arrays of bin edges, contents and sum of squares of weights (sumw2).
+    Cells are laid out as in ROOT, including under- and overflow: contents[yBin, xBin] for 2D histograms, contents[xBin] for 1D histograms.'''
+    def __init__(self, binEdges=None, contents=None, sumw2=None, name="", title="", className=None, entries=0., axisTitles=None, variableBinning=None):
+        if (binEdges is None): sys.exit("ERROR in tmArrayHistogram: binEdges must be a list of arrays of bin edges, one per axis.")
+        if not(len(binEdges) in [1, 2]): sys.exit("ERROR in tmArrayHistogram: only 1D and 2D histograms are supported. Number of axes passed: {n}".format(n=len(binEdges)))
+        self.binEdges = [numpy.array(axisBinEdges, dtype=numpy.float64) for axisBinEdges in binEdges]
+        for axisBinEdges in self.binEdges:
+            if ((len(axisBinEdges) < 2) or not(numpy.all(numpy.diff(axisBinEdges) > 0.))): sys.exit("ERROR in tmArrayHistogram: bin edges must contain at least two strictly increasing values. Passed: {e}".format(e=axisBinEdges))
+        cellsShape = tuple([1+len(axisBinEdges) for axisBinEdges in reversed(self.binEdges)])
+        self.contents = numpy.zeros(cellsShape)
+        if not(contents is None): self.contents = numpy.array(contents, dtype=numpy.float64).reshape(cellsShape)
+        self.sumw2 = numpy.zeros(cellsShape)
+        if not(sumw2 is None): self.sumw2 = numpy.array(sumw2, dtype=numpy.float64).reshape(cellsShape)
+        self.name = name
+        self.title = title
+        self.className = className
+        if (self.className is None): self.className = ["TH1D", "TH2D"][len(self.binEdges)-1]
+        self.entries = entries
+        self.axisTitles = axisTitles
+        if (self.axisTitles is None): self.axisTitles = [""]*len(self.binEdges)
+        self.variableBinning = variableBinning
+        if (self.variableBinning is None): self.variableBinning = [True]*len(self.binEdges)
+
+    @staticmethod
+    def fromTH1(inputTH1):
+        '''Converts a TH1 or TH2 into a tmArrayHistogram, keeping edges, contents, sumw2, entries, titles and the histogram class.'''
+        import ROOT, tmROOTUtils
+        if not(inputTH1.InheritsFrom("TH1") == ROOT.kTRUE) or (inputTH1.InheritsFrom("TH3") == ROOT.kTRUE): sys.exit("ERROR in tmArrayHistogram.fromTH1: input must be a TH1 or TH2. Class: {c}".format(c=inputTH1.ClassName()))
+        if tmROOTUtils.isTH1Profile(inputTH1): sys.exit("ERROR in tmArrayHistogram.fromTH1: profiles are not supported, as their sumw2 holds the sums of w*y^2 rather than the squared errors. Class: {c}".format(c=inputTH1.ClassName()))
+        axes = [inputTH1.GetXaxis(), inputTH1.GetYaxis()][:inputTH1.GetDimension()]
+        contents = tmROOTUtils.getTH1ContentsArray(inputTH1)
+        sumw2 = numpy.abs(contents) # errors on histograms without sumw2 are sqrt(|content|)
+        if (inputTH1.GetSumw2N() > 0): sumw2 = numpy.frombuffer(inputTH1.GetSumw2().GetArray(), dtype=numpy.float64, count=inputTH1.GetNcells()).copy()
+        return tmArrayHistogram(binEdges=[tmROOTUtils.getAxisBinEdgesArray(axis) for axis in axes], contents=contents, sumw2=sumw2,
+                                name=inputTH1.GetName(), title=inputTH1.GetTitle(), className=inputTH1.ClassName(), entries=inputTH1.GetEntries(),
+                                axisTitles=[axis.GetTitle() for axis in axes], variableBinning=[axis.IsVariableBinSize() for axis in axes])
+
+    def toTH1(self, name=None):
+        '''Converts back into a ROOT histogram of the original class (TH1D/TH2D by default).'''
+        import ROOT
+        if (name is None): name = self.name
+        axesArguments = []
+        for axisBinEdges, axisIsVariable in zip(self.binEdges, self.variableBinning):
+            if axisIsVariable: axesArguments += [len(axisBinEdges)-1, axisBinEdges]
+            else: axesArguments += [len(axisBinEdges)-1, axisBinEdges[0], axisBinEdges[-1]]
+        outputTH1 = getattr(ROOT, self.className)(name, self.title, *axesArguments)
+        outputTH1.SetDirectory(0)
+        outputTH1.Sumw2()
+        outputTH1.SetContent(numpy.ascontiguousarray(self.contents.ravel()))
+        outputTH1.GetSumw2().Set(outputTH1.GetNcells(), numpy.ascontiguousarray(self.sumw2.ravel()))
+        outputTH1.SetEntries(self.entries)
+        for axis, axisTitle in zip([outputTH1.GetXaxis(), outputTH1.GetYaxis()], self.axisTitles):
+            axis.SetTitle(axisTitle)
+        return outputTH1
+
+    def clone(self, name=None):
+        if (name is None): name = self.name
+        return tmArrayHistogram(binEdges=self.binEdges, contents=self.contents, sumw2=self.sumw2, name=name, title=self.title, className=self.className, entries=self.entries, axisTitles=list(self.axisTitles), variableBinning=list(self.variableBinning))
+
+    def getDimension(self):
+        return len(self.binEdges)
+
+    def getNBins(self, axisIndex=0):
+        return len(self.binEdges[axisIndex])-1
+
+    def getBinCenters(self, axisIndex=0):
+        return 0.5*(self.binEdges[axisIndex][:-1] + self.binEdges[axisIndex][1:])
+
+    def getBinWidths(self, axisIndex=0):
+        return numpy.diff(self.binEdges[axisIndex])
+
+    def getErrors(self):
+        return numpy.sqrt(self.sumw2)
+
+    def getInnerCells(self, cellsArray):
+        return cellsArray[tuple([slice(1, -1)]*self.getDimension())]
+
+    def findBin(self, xValue, axisIndex=0):
+        # Same convention as TAxis::FindFixBin: 0 is the underflow bin, 1+nBins the overflow bin
+        return int(numpy.searchsorted(self.binEdges[axisIndex], xValue, side="right"))
+
+    def isAlignedWith(self, otherHistogram):
+        if not(self.getDimension() == otherHistogram.getDimension()):
+            print("histograms have different dimensions: {d1}, {d2}".format(d1=self.getDimension(), d2=otherHistogram.getDimension()))
+            return False
+        for axisIndex in range(self.getDimension()):
+            if not(self.getNBins(axisIndex) == otherHistogram.getNBins(axisIndex)):
+                print("number of bins along axis {a} do not match: {n1}, {n2}".format(a=axisIndex, n1=self.getNBins(axisIndex), n2=otherHistogram.getNBins(axisIndex)))
+                return False
+            binCenters = self.getBinCenters(axisIndex)
+            if not(numpy.all(numpy.abs(binCenters - otherHistogram.getBinCenters(axisIndex)) < ZERO_TOLERANCE*numpy.maximum(1., numpy.abs(binCenters)))):
+                print("bin centers do not align along axis {a}".format(a=axisIndex))
+                return False
+        return True
+
+    def scale(self, scaleFactor):
+        self.contents *= scaleFactor
+        self.sumw2 *= scaleFactor*scaleFactor
+
+    def getSumOfBinContents(self, includeUnderflow=False, includeOverflow=False):
+        firstBin = 1
+        if includeUnderflow: firstBin = 0
+        slices = []
+        for axisIndex in reversed(range(self.getDimension())):
+            lastBin = self.getNBins(axisIndex)
+            if includeOverflow: lastBin = 1+self.getNBins(axisIndex)
+            slices.append(slice(firstBin, 1+lastBin))
+        return float(numpy.sum(self.contents[tuple(slices)]))
+
+    def getIntegralTimesBinWidths(self):
+        # Equivalent of TH1::Integral("width")
+        binAreas = self.getBinWidths(0)
+        if (self.getDimension() == 2): binAreas = numpy.outer(self.getBinWidths(1), self.getBinWidths(0))
+        return float(numpy.sum(self.getInnerCells(self.contents)*binAreas))
+
+    def normalize(self):
+        normalizationFactor = self.getIntegralTimesBinWidths()
+        if (normalizationFactor == 0.):
+            print("No entries in histogram with title " + self.title + " to normalize")
+            return
+        self.scale(1./normalizationFactor)
+
+    def rescaleByBinWidth(self):
+        if not(self.getDimension() == 1): sys.exit("Unable to scale 2D histograms.")
+        binWidths = self.getBinWidths()
+        binWidths = numpy.concatenate(([binWidths[0]], binWidths, [binWidths[-1]])) # under- and overflow use the widths of the first and last bins, as in ROOT
+        self.contents /= binWidths
+        self.sumw2 /= numpy.square(binWidths)
+
+    def getRatio(self, denominatorHistogram, valueAtZeroDenominator=0., name="ratio", title=""):
+        '''Same conventions as tmROOTUtils.getRatioHistogram: under- and overflow are copied from the numerator (self).'''
+        if not(self.isAlignedWith(denominatorHistogram)): sys.exit("ERROR: Numerator and denominator histograms do not align.")
+        numerators = self.contents
+        denominators = denominatorHistogram.contents
+        ratios = numpy.full(numerators.shape, float(valueAtZeroDenominator))
+        ratioFractionalErrorsSquared = numpy.zeros(numerators.shape)
+        hasPositiveDenominator = (denominators > 0.)
+        ratios[hasPositiveDenominator] = numerators[hasPositiveDenominator]/denominators[hasPositiveDenominator]
+        hasPositiveNumeratorAndDenominator = (hasPositiveDenominator & (numerators > 0.))
+        ratioFractionalErrorsSquared[hasPositiveNumeratorAndDenominator] = (self.sumw2[hasPositiveNumeratorAndDenominator]/numpy.square(numerators[hasPositiveNumeratorAndDenominator])
+                                                                            + denominatorHistogram.sumw2[hasPositiveNumeratorAndDenominator]/numpy.square(denominators[hasPositiveNumeratorAndDenominator]))
+        outputHistogram = self.clone(name=name)
+        outputHistogram.title = title
+        innerCells = tuple([slice(1, -1)]*self.getDimension())
+        outputHistogram.contents[innerCells] = ratios[innerCells]
+        outputHistogram.sumw2[innerCells] = (numpy.square(ratios)*ratioFractionalErrorsSquared)[innerCells]
+        return outputHistogram
+
+    def getCorrectedBySlope(self, slope, normX):
+        '''Same conventions as tmROOTUtils.getHistogramCorrectedBySlope.'''
+        if not(self.getDimension() == 1): sys.exit("ERROR: slope correction is only defined for 1D histograms.")
+        normBinIndex = self.findBin(normX)
+        if ((normBinIndex == 0) or (normBinIndex > self.getNBins())): sys.exit("ERROR: normX = {n} corresponds to normBinIndex = {nBI} which is outside the histogram range!".format(n=normX, nBI=normBinIndex))
+        adjustments = numpy.ones(self.contents.shape)
+        adjustments[1:-1] = 1.0 + slope*(self.getBinCenters() - normX)
+        outputHistogram = self.clone()
+        outputHistogram.contents /= adjustments
+        outputHistogram.sumw2 /= numpy.square(adjustments)
+        return outputHistogram
+
+def tmArrayHistogramTest():
+    print("Beginning tests...")
+    numerator = tmArrayHistogram(binEdges=[[0., 1., 2., 4.]], contents=[0., 4., 9., 16., 0.], sumw2=[0., 4., 9., 16., 0.], name="numerator")
+    denominator = tmArrayHistogram(binEdges=[[0., 1., 2., 4.]], contents=[0., 2., 0., 8., 0.], sumw2=[0., 2., 0., 8., 0.], name="denominator")
+    ratio = numerator.getRatio(denominator)
+    print("Ratio contents: expected [2, 0, 2], found: {r}".format(r=ratio.getInnerCells(ratio.contents)))
+    print("Sum of bin contents: expected 29, found: {s}".format(s=numerator.getSumOfBinContents()))
+    numerator.rescaleByBinWidth()
+    print("Contents rescaled by bin width: expected [4, 9, 8], found: {c}".format(c=numerator.getInnerCells(numerator.contents)))
+    numerator.normalize()
+    print("Integral after normalization: expected 1, found: {i}".format(i=numerator.getIntegralTimesBinWidths()))
+    corrected = denominator.getCorrectedBySlope(slope=1.0, normX=0.5)
+    print("Slope-corrected contents: expected [2, 0, 2.286], found: {c}".format(c=corrected.getInnerCells(corrected.contents)))
+    print("Finished tests.")
+
+if __name__ == "__main__":
+    tmArrayHistogramTest()
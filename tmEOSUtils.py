@@ -1,55 +1,82 @@
 from __future__ import print_function, division
 
-import os, sys, subprocess, tmGeneralUtils
+import os, sys, time, subprocess, concurrent.futures, tmGeneralUtils
 
 EOSPrefix = os.getenv("EOSPREFIX")
 EOStmpArea = os.getenv("EOSTMPAREA")
+DEFAULT_MAX_CONCURRENT_LISTINGS = 8
 
-def generate_list_of_files_in_eos_path(eos_path=None, appendPrefix=True, vetoPattern=None, restrictToROOTFiles=True, fetchSizeInfo=False):
+def parse_eos_ls_mtime(month, day, timeOrYear):
+    # "eos ls -l" prints mtimes like "ls -l": "Aug 12 10:00" for recent entries (year implied) and "Aug 12 2023" for entries older than six months.
+    # Returns the earliest epoch time consistent with the printed mtime, which only has a resolution of a minute (or a day).
+    if (":" in timeOrYear):
+        currentTime = time.time()
+        year = time.localtime(currentTime).tm_year
+        mtimeSeconds = time.mktime(time.strptime("{y} {m} {d} {t}".format(y=year, m=month, d=day, t=timeOrYear), "%Y %b %d %H:%M"))
+        if (mtimeSeconds > currentTime + 86400.): mtimeSeconds = time.mktime(time.strptime("{y} {m} {d} {t}".format(y=year-1, m=month, d=day, t=timeOrYear), "%Y %b %d %H:%M")) # recent entries from last year
+        return mtimeSeconds
+    return time.mktime(time.strptime("{y} {m} {d}".format(y=timeOrYear, m=month, d=day), "%Y %b %d"))
+
+def parse_eos_ls_line(lineRaw):
+    # Returns None for empty lines and for the "." and ".." entries
+    fileOrDirectoryDetails = (lineRaw.strip()).split()
+    if ((len(fileOrDirectoryDetails) == 0) or (fileOrDirectoryDetails[-1] == ".") or (fileOrDirectoryDetails[-1] == "..")): return None
+    if (len(fileOrDirectoryDetails) < 9): sys.exit("ERROR: Unable to parse eos ls line: {l}".format(l=lineRaw))
+    fileOrDirectoryPermissionsString = fileOrDirectoryDetails[0]
+    return {"name": fileOrDirectoryDetails[-1],
+            "isDirectory": (fileOrDirectoryPermissionsString[0] == "d"),
+            "isFile": (fileOrDirectoryPermissionsString[0] == "-"),
+            "size": int(0.5 + float(fileOrDirectoryDetails[4])),
+            "mtime": " ".join(fileOrDirectoryDetails[5:8]),
+            "mtimeSeconds": parse_eos_ls_mtime(*fileOrDirectoryDetails[5:8])}
+
+def list_eos_directory(eos_path):
+    # Output is read straight from the pipe, no temporary files needed
+    eos_ls_output = subprocess.check_output("/usr/bin/eos {eP} ls -a -l {p}".format(eP=EOSPrefix, p=eos_path), shell=True, universal_newlines=True, executable="/bin/bash")
+    entries = []
+    for lineRaw in eos_ls_output.splitlines():
+        entry = parse_eos_ls_line(lineRaw)
+        if not(entry is None): entries.append(entry)
+    return entries
+
+def generate_eos_directory_listings(eos_path=None, maxConcurrentListings=DEFAULT_MAX_CONCURRENT_LISTINGS):
+    # Walks the tree under eos_path and yields (directory path, list of entries) for each directory as soon as its listing is available.
+    # Up to maxConcurrentListings "eos ls" processes run at the same time; directories are therefore not yielded in depth-first order.
     if (eos_path is None): sys.exit("ERROR: eos_path cannot be None.")
-    subprocess.check_call("mkdir -p {ETA}".format(ETA=EOStmpArea), shell=True)
-    subprocess.check_call("bash -c \"/usr/bin/eos {eP} ls -a -l {p} > {ETA}/EOS_tmpFileList.txt 2>&1\"".format(eP=EOSPrefix, p=eos_path, ETA=EOStmpArea), shell=True)
-    fileList = open("{ETA}/EOS_tmpFileList.txt".format(ETA=EOStmpArea), "r")
-    entriesToCheck = fileList.readlines()
-    fileList.close()
-    subprocess.check_call("rm -f {ETA}/EOS_tmpFileList.txt".format(ETA=EOStmpArea), shell=True)
-    for lineRaw in entriesToCheck:
-        fileOrDirectoryDetails = (lineRaw.strip()).split()
-        if ((fileOrDirectoryDetails[-1] == ".") or (fileOrDirectoryDetails[-1] == "..")):
-            continue
-        else:
-            fileOrDirectoryPermissionsString = fileOrDirectoryDetails[0]
-            if (fileOrDirectoryPermissionsString[0] == "d"):
-                directoryName = fileOrDirectoryDetails[-1]
-                list_of_files_in_eos_subfolder_generator = generate_list_of_files_in_eos_path(eos_path="{p}/{dN}".format(p=eos_path, dN=directoryName), appendPrefix=appendPrefix, vetoPattern=vetoPattern, restrictToROOTFiles=restrictToROOTFiles, fetchSizeInfo=fetchSizeInfo)
-                if (fetchSizeInfo):
-                    for file_size_pair in list_of_files_in_eos_subfolder_generator:
-                        yield (file_size_pair[0], file_size_pair[1])
-                else:
-                    for file_in_eos_subfolder in list_of_files_in_eos_subfolder_generator:
-                        yield file_in_eos_subfolder
-            elif (fileOrDirectoryPermissionsString[0] == "-"):
-                fileName = fileOrDirectoryDetails[-1]
-                isCandidateToYield = True
-                if (restrictToROOTFiles): isCandidateToYield = (fileName[-5:] == ".root")
-                if isCandidateToYield:
-                    fullFilePath = ""
-                    if (appendPrefix):
-                        fullFilePath += "{eP}".format(eP=EOSPrefix)
-                    fullFilePath += "{p}/{f}".format(p=eos_path, f=fileName)
-                    if (fetchSizeInfo):
-                        size = int(0.5 + float(fileOrDirectoryDetails[4]))
-                        if (vetoPattern is None):
-                            yield (fullFilePath, size)
-                        else:
-                            if not(vetoPattern in fullFilePath):
-                                yield (fullFilePath, size)
-                    else:
-                        if (vetoPattern is None):
-                            yield fullFilePath
-                        else:
-                            if not(vetoPattern in fullFilePath):
-                                yield fullFilePath
+    listingsPool = concurrent.futures.ThreadPoolExecutor(max_workers=maxConcurrentListings)
+    pendingListings = {listingsPool.submit(list_eos_directory, eos_path): eos_path}
+    try:
+        while (len(pendingListings) > 0):
+            completedListings, notYetCompletedListings = concurrent.futures.wait(list(pendingListings.keys()), return_when=concurrent.futures.FIRST_COMPLETED)
+            for completedListing in completedListings:
+                directoryPath = pendingListings.pop(completedListing)
+                entries = completedListing.result()
+                for entry in entries:
+                    if entry["isDirectory"]:
+                        subdirectoryPath = "{p}/{dN}".format(p=directoryPath, dN=entry["name"])
+                        pendingListings[listingsPool.submit(list_eos_directory, subdirectoryPath)] = subdirectoryPath
+                yield (directoryPath, entries)
+    finally: # also reached if the caller stops iterating early
+        for pendingListing in pendingListings:
+            pendingListing.cancel()
+        listingsPool.shutdown(wait=True)
+
+def generate_list_of_files_in_eos_path(eos_path=None, appendPrefix=True, vetoPattern=None, restrictToROOTFiles=True, fetchSizeInfo=False, maxConcurrentListings=DEFAULT_MAX_CONCURRENT_LISTINGS):
+    if (eos_path is None): sys.exit("ERROR: eos_path cannot be None.")
+    for directoryPath, entries in generate_eos_directory_listings(eos_path=eos_path, maxConcurrentListings=maxConcurrentListings):
+        for entry in entries:
+            if not(entry["isFile"]): continue
+            fileName = entry["name"]
+            if (restrictToROOTFiles and not(fileName[-5:] == ".root")): continue
+            fullFilePath = ""
+            if (appendPrefix):
+                fullFilePath += "{eP}".format(eP=EOSPrefix)
+            fullFilePath += "{p}/{f}".format(p=directoryPath, f=fileName)
+            if (not(vetoPattern is None) and (vetoPattern in fullFilePath)): continue
+            if (fetchSizeInfo):
+                yield (fullFilePath, entry["size"])
+            else:
+                yield fullFilePath
 
 def get_eos_file_size_in_bytes(fullFilePath):
     filePathFormatted = fullFilePath.replace("/", "_")
@@ -61,50 +88,56 @@ def get_eos_file_size_in_bytes(fullFilePath):
     if (not(len(fileDetailsContents)) == 1): sys.exit("ERROR: details file contains more than one line.")
     return (int(0.5 + float((fileDetailsContents[0].strip().split())[4])))
 
-def generate_dirsizes_info(eos_path=None):
+def get_eos_dirsizes_tree(eos_path=None, maxConcurrentListings=DEFAULT_MAX_CONCURRENT_LISTINGS):
+    # Walks the tree under eos_path once. Returns a dictionary mapping the path of every file and directory, relative to eos_path, to a pair (isDirectory, size in bytes);
+    # directory sizes include everything below them. The entry for eos_path itself has relative path "".
+    if (eos_path is None): sys.exit("ERROR: eos_path cannot be None.")
+    dirsizes_tree = {"": (True, 0)}
+    for directoryPath, entries in generate_eos_directory_listings(eos_path=eos_path, maxConcurrentListings=maxConcurrentListings):
+        relativeDirectoryPath = (directoryPath[len(eos_path):]).strip("/")
+        sizeOfFilesInDirectory = 0
+        for entry in entries:
+            relativePath = entry["name"]
+            if (len(relativeDirectoryPath) > 0): relativePath = "{d}/{n}".format(d=relativeDirectoryPath, n=entry["name"])
+            if entry["isDirectory"]:
+                if not(relativePath in dirsizes_tree): dirsizes_tree[relativePath] = (True, 0) # its listing may also have been processed already
+            elif entry["isFile"]:
+                dirsizes_tree[relativePath] = (False, entry["size"])
+                sizeOfFilesInDirectory += entry["size"]
+        # Roll the sizes of the files found in this directory up to the directory and all its ancestors
+        ancestorPath = relativeDirectoryPath
+        while True:
+            isDirectory, size = dirsizes_tree.get(ancestorPath, (True, 0))
+            dirsizes_tree[ancestorPath] = (True, size + sizeOfFilesInDirectory)
+            if (ancestorPath == ""): break
+            ancestorPath = "/".join((ancestorPath.split("/"))[:-1])
+    return dirsizes_tree
+
+def generate_dirsizes_info(eos_path=None, maxConcurrentListings=DEFAULT_MAX_CONCURRENT_LISTINGS):
     if (eos_path is None): sys.exit("ERROR: eos_path cannot be None.")
-    subprocess.check_call("mkdir -p {ETA}".format(ETA=EOStmpArea), shell=True)
-    subprocess.check_call("bash -c \"/usr/bin/eos {eP} ls -a -lh {p} > {ETA}/EOS_tmpFolderList.txt 2>&1\"".format(eP=EOSPrefix, p=eos_path, ETA=EOStmpArea), shell=True)
-    fileList = open("{ETA}/EOS_tmpFolderList.txt".format(ETA=EOStmpArea), "r")
-    entriesToCheck = fileList.readlines()
-    fileList.close()
-    subprocess.check_call("rm -f {ETA}/EOS_tmpFolderList.txt".format(ETA=EOStmpArea), shell=True)
-    for lineRaw in entriesToCheck:
-        fileOrDirectoryDetails = (lineRaw.strip()).split()
-        if ((fileOrDirectoryDetails[-1] == ".") or (fileOrDirectoryDetails[-1] == "..")):
-            continue
-        else:
-            fileOrDirectoryPermissionsString = fileOrDirectoryDetails[0]
-            if (fileOrDirectoryPermissionsString[0] == "d"):
-                directoryName = fileOrDirectoryDetails[-1]
-                print("Getting size info for folder: {f}".format(f=directoryName))
-                directory_total_size = 0
-                list_of_files_in_eos_subfolder_generator = generate_list_of_files_in_eos_path(eos_path="{p}/{dN}".format(p=eos_path, dN=directoryName), appendPrefix=False, restrictToROOTFiles=False, fetchSizeInfo=True)
-                for file_size_pair in list_of_files_in_eos_subfolder_generator:
-                    directory_total_size += file_size_pair[1]
-                yield (directoryName, directory_total_size)
-            elif (fileOrDirectoryPermissionsString[0] == "-"):
-                fileName = fileOrDirectoryDetails[-1]
-                print("Getting size info for file: {f}".format(f=fileName))
-                fullFilePath = "{p}/{f}".format(p=eos_path, f=fileName)
-                yield (fileName, get_eos_file_size_in_bytes(fullFilePath))
+    dirsizes_tree = get_eos_dirsizes_tree(eos_path=eos_path, maxConcurrentListings=maxConcurrentListings)
+    for relativePath in sorted(dirsizes_tree.keys()):
+        if ((relativePath == "") or ("/" in relativePath)): continue
+        yield (relativePath, dirsizes_tree[relativePath][1])
 
-def print_eos_dirsizes(eos_path=None):
+def print_eos_dirsizes(eos_path=None, maxDepth=1, maxConcurrentListings=DEFAULT_MAX_CONCURRENT_LISTINGS):
+    # du-style printout: directories up to maxDepth levels below eos_path, plus the files directly inside eos_path
     if (eos_path is None): sys.exit("ERROR: eos_path cannot be None.")
-    nameSizeDict = {}
+    dirsizes_tree = get_eos_dirsizes_tree(eos_path=eos_path, maxConcurrentListings=maxConcurrentListings)
     namesList = []
-    totalSize = 0
-    for nameSizePair in generate_dirsizes_info(eos_path=eos_path):
-        name = nameSizePair[0]
-        size = nameSizePair[1]
-        namesList.append(name)
-        nameSizeDict[name] = size
-        totalSize += size
+    for relativePath in sorted(dirsizes_tree.keys(), key=(lambda path: path.split("/"))): # parents immediately followed by their children
+        if (relativePath == ""): continue
+        depth = 1 + relativePath.count("/")
+        isDirectory = dirsizes_tree[relativePath][0]
+        if ((depth == 1) or (isDirectory and (depth <= maxDepth))): namesList.append(relativePath)
+    if (len(namesList) == 0):
+        print("No files or directories found in {p}".format(p=eos_path))
+        return
     nameLength = 3 + max(len(name) for name in namesList)
     for name in namesList:
-        print("{n}: {s}".format(n=tmGeneralUtils.alignFixedWidthStringLeft(nameLength, name), s=tmGeneralUtils.get_bytesize_human_readable(size_in_bytes_raw=nameSizeDict[name])))
+        print("{n}: {s}".format(n=tmGeneralUtils.alignFixedWidthStringLeft(nameLength, name), s=tmGeneralUtils.get_bytesize_human_readable(size_in_bytes_raw=dirsizes_tree[name][1])))
     print("-"*100)
-    print("{tSS}: {tS}".format(tSS=tmGeneralUtils.alignFixedWidthStringLeft(nameLength, "Total size") ,tS=tmGeneralUtils.get_bytesize_human_readable(size_in_bytes_raw=totalSize)))
+    print("{tSS}: {tS}".format(tSS=tmGeneralUtils.alignFixedWidthStringLeft(nameLength, "Total size") ,tS=tmGeneralUtils.get_bytesize_human_readable(size_in_bytes_raw=dirsizes_tree[""][1])))
 
 def test():
     print("Without veto pattern:")
@@ -117,6 +150,8 @@ def test():
         print("Found file: {f}".format(f=fname))
     print("Printing EOS dirsizes in folder /store/user/lpcsusystealth/statistics/:")
     print_eos_dirsizes(eos_path="/store/user/lpcsusystealth/statistics/")
+    print("Printing EOS dirsizes in folder /store/user/lpcsusystealth/statistics/, up to three levels deep:")
+    print_eos_dirsizes(eos_path="/store/user/lpcsusystealth/statistics/", maxDepth=3)
 
 if __name__ == "__main__":
     test()
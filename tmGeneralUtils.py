@@ -1,6 +1,10 @@
 from __future__ import print_function, division
 
-import sys
+import os, sys
+
+CONFIGURATION_PARAMETER_TYPES = ["int", "float", "string"]
+BINARY_SIDECAR_SUFFIX = ".npz"
+configurationsCache = {} # real path -> (mtime in ns, size, configuration), filled by getCachedConfigurationFromFile
 
 def alignFixedWidthFloatLeft(width, precision, number):
     if not(isinstance(number, float) or isinstance(number, int)): sys.exit("alignFixedWidthFloatLeft called with non-float object: {o}".format(o=number))
@@ -36,37 +40,120 @@ def prettyPrintDictionary(inputDict, valueFormatSpecification="", keyPrintOrder=
             printStatement += "{dictionaryContent:" + valueFormatSpecification + "}"
         print(printStatement.format(keyName=key, dictionaryContent=inputDict[key]))
 
+def parseConfigurationLine(line):
+    # Parses "type name=value": the type ends at the first whitespace and the name at the first "=", so string values can contain spaces and "=" signs.
+    # Returns (type, name, value), or None for blank lines.
+    lineStripped = line.strip()
+    if (len(lineStripped) == 0): return None
+    typeAndNameValueString = lineStripped.split(None, 1)
+    if not((len(typeAndNameValueString) == 2) and ("=" in typeAndNameValueString[1])): sys.exit("ERROR: unable to parse the following as \"type arg=value\": {line}".format(line=line))
+    parameterType = typeAndNameValueString[0]
+    parameterName, parameterValueString = typeAndNameValueString[1].split("=", 1)
+    parameterName = parameterName.strip()
+    parameterValueString = parameterValueString.strip()
+    if parameterType == "int":
+        value = int(parameterValueString)
+    elif parameterType == "float":
+        value = float(parameterValueString)
+    elif parameterType == "string":
+        value = parameterValueString
+    else:
+        sys.exit("Unrecognized parameter type: {pT}".format(pT=parameterType))
+    return (parameterType, parameterName, value)
+
+def getBinarySidecarPath(inputFilePath):
+    return inputFilePath + BINARY_SIDECAR_SUFFIX
+
+def getConfigurationFromBinaryFile(inputFilePath):
+    # Reads the .npz files written by writeConfigurationParametersToFile: the names and types of all parameters in write order, and for each type, an array of values.
+    # Parameters are set in write order, so that, as in the text file, the last one wins if a name appears more than once.
+    import numpy
+    configuration = {}
+    with numpy.load(inputFilePath, allow_pickle=False) as binaryContents:
+        valuesByType = {}
+        for parameterType in CONFIGURATION_PARAMETER_TYPES:
+            if ("{t}_values".format(t=parameterType) in binaryContents.files): valuesByType[parameterType] = iter(binaryContents["{t}_values".format(t=parameterType)].tolist())
+        for parameterName, parameterType in zip(binaryContents["names"].tolist(), binaryContents["types"].tolist()):
+            configuration[parameterName] = next(valuesByType[parameterType])
+    return configuration
+
 def getConfigurationFromFile(inputFilePath):
+    # .npz files, and text files with an up-to-date .npz sidecar next to them, are read without any line-by-line parsing
+    if inputFilePath.endswith(BINARY_SIDECAR_SUFFIX): return getConfigurationFromBinaryFile(inputFilePath)
+    binarySidecarPath = getBinarySidecarPath(inputFilePath)
+    if (os.path.isfile(binarySidecarPath) and (os.stat(binarySidecarPath).st_mtime_ns >= os.stat(inputFilePath).st_mtime_ns)): return getConfigurationFromBinaryFile(binarySidecarPath)
     configuration = {}
     configurationFileObject = open(inputFilePath, "r")
     for line in configurationFileObject:
-        splitLine = line.split()
-        parameterType = splitLine[0]
-        whitespaceRemovedNameValueString = "".join(splitLine[1:])
-        nameValuePair = whitespaceRemovedNameValueString.split("=")
-        if not(len(nameValuePair) == 2): sys.exit("ERROR: unable to parse the following as \"type arg=value\": {line}, or, split: {sL}. Attempted parameter type: {pT}, name-value pair string: {nVPS}, name-value pair: {nVP}".format(line=line, sL=splitLine, pT=parameterType, nVPS=whitespaceRemovedNameValueString, nVP=str(nameValuePair)))
-        if parameterType == "int":
-            value = int(nameValuePair[1])
-        elif parameterType == "float":
-            value = float(nameValuePair[1])
-        elif parameterType == "string":
-            value = nameValuePair[1]
-        else:
-            sys.exit("Unrecognized parameter type: {pT}".format(pT=parameterType))
-        configuration[nameValuePair[0]] = value
+        parsedLine = parseConfigurationLine(line)
+        if (parsedLine is None): continue
+        configuration[parsedLine[1]] = parsedLine[2]
     configurationFileObject.close()
     return configuration
 
-def writeConfigurationParametersToFile(configurationParametersList, outputFilePath):
+def getCachedConfigurationFromFile(inputFilePath):
+    # Parses each file only once, and again only if its modification time or size have changed. Returns a copy, which callers are free to modify.
+    realInputFilePath = os.path.realpath(inputFilePath)
+    inputFileStat = os.stat(realInputFilePath)
+    cachedEntry = configurationsCache.get(realInputFilePath)
+    if ((cachedEntry is None) or not((cachedEntry[0] == inputFileStat.st_mtime_ns) and (cachedEntry[1] == inputFileStat.st_size))):
+        cachedEntry = (inputFileStat.st_mtime_ns, inputFileStat.st_size, getConfigurationFromFile(realInputFilePath))
+        configurationsCache[realInputFilePath] = cachedEntry
+    return dict(cachedEntry[2])
+
+def getMergedConfigurationFromFiles(inputFilePaths, allowOverrides=False):
+    # Parameters from later files override those from earlier ones if allowOverrides is True; otherwise a parameter set to different values in two files is an error
+    mergedConfiguration = {}
+    parameterSources = {}
+    for inputFilePath in inputFilePaths:
+        for parameterName, parameterValue in getCachedConfigurationFromFile(inputFilePath).items():
+            if (not(allowOverrides) and (parameterName in mergedConfiguration) and not(mergedConfiguration[parameterName] == parameterValue)):
+                sys.exit("ERROR: parameter {n} set to {v1} in {f1} but to {v2} in {f2}".format(n=parameterName, v1=mergedConfiguration[parameterName], f1=parameterSources[parameterName], v2=parameterValue, f2=inputFilePath))
+            mergedConfiguration[parameterName] = parameterValue
+            parameterSources[parameterName] = inputFilePath
+    return mergedConfiguration
+
+def writeConfigurationParametersToFile(configurationParametersList, outputFilePath, writeBinarySidecar=False):
+    # Everything written here is read back identically by getConfigurationFromFile; parameters that could not be are rejected.
+    # With writeBinarySidecar=True, the parameters are also saved as numpy arrays in outputFilePath + ".npz", which getConfigurationFromFile then reads instead.
+    binarySidecarPath = getBinarySidecarPath(outputFilePath)
+    if os.path.isfile(binarySidecarPath): os.remove(binarySidecarPath) # would be out of date
+    parameterNames = []
+    parameterTypes = []
+    valuesByType = {parameterType: [] for parameterType in CONFIGURATION_PARAMETER_TYPES}
     outputFileObject = open(outputFilePath, "w")
     for configurationParameters in configurationParametersList:
         if not(len(configurationParameters) == 3): sys.exit("ERROR: configuration parameters {cP} not in format (type, name, value)".format(cP=str(configurationParameters)))
         parameterType = configurationParameters[0]
-        if not(parameterType in ["int", "float", "string"]): sys.exit("ERROR: Unrecognized parameter type from configuration parameters: {cP}, containing type: {t}".format(cP=str(configurationParameters), t=parameterType))
-        parameterName = configurationParameters[1]
+        if not(parameterType in CONFIGURATION_PARAMETER_TYPES): sys.exit("ERROR: Unrecognized parameter type from configuration parameters: {cP}, containing type: {t}".format(cP=str(configurationParameters), t=parameterType))
+        parameterName = str(configurationParameters[1])
+        if ((len(parameterName) == 0) or ("=" in parameterName) or any(character.isspace() for character in parameterName)): sys.exit("ERROR: parameter names must be non-empty and cannot contain whitespace or \"=\". Configuration parameters: {cP}".format(cP=str(configurationParameters)))
         parameterValue = configurationParameters[2]
+        if (parameterType == "float"): parameterValue = repr(float(parameterValue)) # shortest string that converts back to exactly the same float
+        elif (parameterType == "int"):
+            try:
+                intValue = int(parameterValue) # also accepts strings such as "3", but not "3.7"
+            except (TypeError, ValueError, OverflowError):
+                intValue = None
+            if ((intValue is None) or not(isinstance(parameterValue, str) or (intValue == parameterValue))): sys.exit("ERROR: int parameter value is not an integer. Configuration parameters: {cP}".format(cP=str(configurationParameters)))
+            parameterValue = intValue
+        else:
+            parameterValue = str(parameterValue)
+            if not(parameterValue.strip() == parameterValue) or ("\n" in parameterValue) or ("\r" in parameterValue): sys.exit("ERROR: string values cannot contain line breaks, or start or end with whitespace. Configuration parameters: {cP}".format(cP=str(configurationParameters)))
         outputFileObject.write("{t} {name}={value}\n".format(t=parameterType, name=parameterName, value=parameterValue))
+        if writeBinarySidecar:
+            parameterNames.append(parameterName)
+            parameterTypes.append(parameterType)
+            valuesByType[parameterType].append(float(parameterValue) if (parameterType == "float") else parameterValue)
     outputFileObject.close()
+    if writeBinarySidecar:
+        import numpy
+        binaryContents = {"names": numpy.array(parameterNames, dtype=numpy.str_), "types": numpy.array(parameterTypes, dtype=numpy.str_)}
+        for parameterType, numpyType in [("int", numpy.int64), ("float", numpy.float64), ("string", numpy.str_)]:
+            if (len(valuesByType[parameterType]) == 0): continue
+            binaryContents["{t}_values".format(t=parameterType)] = numpy.array(valuesByType[parameterType], dtype=numpyType)
+        with open(binarySidecarPath, "wb") as binarySidecarFileObject: # written after the text file, so that it is not older than it
+            numpy.savez(binarySidecarFileObject, **binaryContents)
 
 def get_bytesize_human_readable(size_in_bytes_raw = -1):
     if (size_in_bytes_raw < 0): sys.exit("ERROR in tmGeneralUtils.get_bytesize_human_readable: argument size_in_bytes_raw must be positive.")
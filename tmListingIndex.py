@@ -0,0 +1,189 @@
+from __future__ import print_function, division
+
+import sys, time, fnmatch, sqlite3, concurrent.futures
+
+DEFAULT_MAX_CONCURRENT_LISTINGS = 8
+DEFAULT_MAX_CONCURRENT_CHECKSUMS = 16
+DEFAULT_MTIME_UNCERTAINTY_SECONDS = 120. # "eos ls -l" mtimes only have a resolution of a minute; also covers some clock skew between the storage and this machine
+GLOB_SPECIAL_CHARACTERS = "*?["
+
+def joinPath(directoryPath, name):
+    if (directoryPath == "/"): return "/{n}".format(n=name)
+    return "{d}/{n}".format(d=directoryPath, n=name)
+
+def normalizePath(path):
+    if (path == "/"): return path
+    return path.rstrip("/")
+
+class tmListingIndex:
+    '''Persistent SQLite index of a remote directory tree: path, size, mtime and (optionally) checksum of every entry.
+
+    listDirectoryFunction(path) must return the entries directly inside path, as a list of dictionaries with the keys
+    "name", "isDirectory", "isFile", "size", "mtime" and "mtimeSeconds" (e.g. tmEOSUtils.list_eos_directory or tmXRootUtils.List_xrdfs_Directory).
+    "mtime" is compared as is; "mtimeSeconds" is the earliest epoch time consistent with it.
+    If checksumFunction(path) is given, checksums are computed for new or modified files only, up to maxConcurrentChecksums at a time.
+
+    Refreshes are incremental: a directory is listed again only if its mtime, as seen in its parent's listing, has changed.
+    This relies on the storage propagating mtimes up the tree (as EOS does); otherwise use forceFullRelisting=True.
+    Listed mtimes have a limited resolution, so an entry modified within mtimeUncertaintySeconds of when it was last listed may have changed again
+    without its mtime changing: such directories are always listed again, and such files always get new checksums.
+    Use one database per storage endpoint: paths are stored without any server prefix.'''
+    def __init__(self, databasePath=None, listDirectoryFunction=None, checksumFunction=None, maxAgeSeconds=3600., maxConcurrentListings=DEFAULT_MAX_CONCURRENT_LISTINGS, maxConcurrentChecksums=DEFAULT_MAX_CONCURRENT_CHECKSUMS, mtimeUncertaintySeconds=DEFAULT_MTIME_UNCERTAINTY_SECONDS):
+        if ((databasePath is None) or (listDirectoryFunction is None)): sys.exit("ERROR in tmListingIndex: both databasePath and listDirectoryFunction must be specified.")
+        self.listDirectoryFunction = listDirectoryFunction
+        self.checksumFunction = checksumFunction
+        self.maxAgeSeconds = maxAgeSeconds
+        self.maxConcurrentListings = maxConcurrentListings
+        self.maxConcurrentChecksums = maxConcurrentChecksums
+        self.mtimeUncertaintySeconds = mtimeUncertaintySeconds
+        self.connection = sqlite3.connect(databasePath)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS entries (path TEXT PRIMARY KEY, parent TEXT NOT NULL, isDirectory INTEGER NOT NULL, size INTEGER NOT NULL, mtime TEXT, checksum TEXT)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS entries_parent ON entries (parent)")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS directories (path TEXT PRIMARY KEY, mtime TEXT, timeListed REAL NOT NULL)")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS roots (path TEXT PRIMARY KEY, timeRefreshed REAL NOT NULL)")
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def getTimeRefreshed(self, path):
+        # Most recent refresh of path itself or of any directory containing it; None if never refreshed
+        path = normalizePath(path)
+        timeRefreshed = None
+        for rootPath, rootTimeRefreshed in self.connection.execute("SELECT path, timeRefreshed FROM roots"):
+            if ((path == rootPath) or path.startswith(joinPath(rootPath, ""))):
+                if ((timeRefreshed is None) or (rootTimeRefreshed > timeRefreshed)): timeRefreshed = rootTimeRefreshed
+        return timeRefreshed
+
+    def ensureFresh(self, path, maxAgeSeconds=None):
+        if (maxAgeSeconds is None): maxAgeSeconds = self.maxAgeSeconds
+        timeRefreshed = self.getTimeRefreshed(path)
+        if ((timeRefreshed is None) or (time.time() - timeRefreshed > maxAgeSeconds)): self.refresh(path)
+
+    def deleteSubtree(self, path):
+        subtreePrefix = joinPath(path, "")
+        self.connection.execute("DELETE FROM entries WHERE path = ? OR substr(path, 1, ?) = ?", (path, len(subtreePrefix), subtreePrefix))
+        self.connection.execute("DELETE FROM directories WHERE path = ? OR substr(path, 1, ?) = ?", (path, len(subtreePrefix), subtreePrefix))
+
+    def isMtimeUnsettled(self, mtimeSeconds, timeListed):
+        # True if the entry may have been modified again after it was listed at timeListed, within the same displayed mtime
+        return (timeListed < mtimeSeconds + self.mtimeUncertaintySeconds)
+
+    def updateDirectory(self, directoryPath, directoryMtime, listedEntries, timeListed):
+        # Replaces the stored children of directoryPath with listedEntries; returns the paths of the subdirectories with their mtimes,
+        # and the paths of the files whose checksums need to be (re)computed. Those files are stored with a null checksum until then.
+        storedChildren = {}
+        for path, isDirectory, size, mtime, checksum in self.connection.execute("SELECT path, isDirectory, size, mtime, checksum FROM entries WHERE parent = ?", (directoryPath,)):
+            storedChildren[path] = (bool(isDirectory), size, mtime, checksum)
+        previousListing = self.connection.execute("SELECT timeListed FROM directories WHERE path = ?", (directoryPath,)).fetchone()
+        subdirectories = []
+        filesWithoutChecksums = []
+        listedPaths = set()
+        for entry in listedEntries:
+            path = joinPath(directoryPath, entry["name"])
+            listedPaths.add(path)
+            checksum = None
+            if (path in storedChildren):
+                storedIsDirectory, storedSize, storedMtime, storedChecksum = storedChildren[path]
+                if not(storedIsDirectory == entry["isDirectory"]): self.deleteSubtree(path)
+                elif ((storedSize == entry["size"]) and (storedMtime == entry["mtime"]) and not(self.isMtimeUnsettled(entry["mtimeSeconds"], previousListing[0]))): checksum = storedChecksum
+            if ((checksum is None) and entry["isFile"] and not(self.checksumFunction is None)): filesWithoutChecksums.append(path)
+            self.connection.execute("INSERT OR REPLACE INTO entries (path, parent, isDirectory, size, mtime, checksum) VALUES (?, ?, ?, ?, ?, ?)", (path, directoryPath, int(entry["isDirectory"]), entry["size"], entry["mtime"], checksum))
+            if entry["isDirectory"]: subdirectories.append((path, entry["mtime"], entry["mtimeSeconds"]))
+        for path in storedChildren:
+            if not(path in listedPaths): self.deleteSubtree(path)
+        self.connection.execute("INSERT OR REPLACE INTO directories (path, mtime, timeListed) VALUES (?, ?, ?)", (directoryPath, directoryMtime, timeListed))
+        return (subdirectories, filesWithoutChecksums)
+
+    def refresh(self, rootPath, forceFullRelisting=False, printVerbose=False):
+        rootPath = normalizePath(rootPath)
+        timeStarted = time.time()
+        nListings = 0
+        nChecksums = 0
+        listingsPool = concurrent.futures.ThreadPoolExecutor(max_workers=self.maxConcurrentListings)
+        pendingListings = {listingsPool.submit(self.listDirectoryFunction, rootPath): (rootPath, None)} # root always listed: its own mtime is not known
+        # Checksums are computed in their own pool, while the listings continue
+        checksumsPool = concurrent.futures.ThreadPoolExecutor(max_workers=self.maxConcurrentChecksums)
+        pendingChecksums = {}
+        try:
+            while (len(pendingListings) > 0):
+                completedListings, notYetCompletedListings = concurrent.futures.wait(list(pendingListings.keys()), return_when=concurrent.futures.FIRST_COMPLETED)
+                for completedListing in completedListings:
+                    directoryPath, directoryMtime = pendingListings.pop(completedListing)
+                    nListings += 1
+                    subdirectories, filesWithoutChecksums = self.updateDirectory(directoryPath, directoryMtime, completedListing.result(), time.time())
+                    for filePath in filesWithoutChecksums:
+                        pendingChecksums[checksumsPool.submit(self.checksumFunction, filePath)] = filePath
+                        nChecksums += 1
+                    for subdirectoryPath, subdirectoryMtime, subdirectoryMtimeSeconds in subdirectories:
+                        storedDirectory = self.connection.execute("SELECT mtime, timeListed FROM directories WHERE path = ?", (subdirectoryPath,)).fetchone()
+                        if (forceFullRelisting or (storedDirectory is None) or not(storedDirectory[0] == subdirectoryMtime) or self.isMtimeUnsettled(subdirectoryMtimeSeconds, storedDirectory[1])):
+                            pendingListings[listingsPool.submit(self.listDirectoryFunction, subdirectoryPath)] = (subdirectoryPath, subdirectoryMtime)
+            for completedChecksum in concurrent.futures.as_completed(list(pendingChecksums.keys())):
+                self.connection.execute("UPDATE entries SET checksum = ? WHERE path = ?", (completedChecksum.result(), pendingChecksums.pop(completedChecksum)))
+            self.connection.execute("INSERT OR REPLACE INTO roots (path, timeRefreshed) VALUES (?, ?)", (rootPath, timeStarted))
+            self.connection.commit()
+        except:
+            self.connection.rollback()
+            raise
+        finally:
+            for pendingFuture in (list(pendingListings.keys()) + list(pendingChecksums.keys())):
+                pendingFuture.cancel()
+            listingsPool.shutdown(wait=True)
+            checksumsPool.shutdown(wait=True)
+        if printVerbose: print("Refreshed index for {p} with {n} directory listings and {c} checksum queries in {t:.1f} s".format(p=rootPath, n=nListings, c=nChecksums, t=time.time()-timeStarted))
+
+    def getFilesWithDetails(self, path, maxAgeSeconds=None):
+        '''Returns (path, size, mtime, checksum) for every file at or below path, sorted by path.'''
+        path = normalizePath(path)
+        self.ensureFresh(path, maxAgeSeconds)
+        subtreePrefix = joinPath(path, "")
+        # Range condition on the primary key, so that SQLite can use its index: "0" is the character immediately after "/"
+        return self.connection.execute("SELECT path, size, mtime, checksum FROM entries WHERE isDirectory = 0 AND (path = ? OR (path >= ? AND path < ?)) ORDER BY path", (path, subtreePrefix, subtreePrefix[:-1] + "0")).fetchall()
+
+    def listFiles(self, path, maxAgeSeconds=None):
+        return [filePath for filePath, size, mtime, checksum in self.getFilesWithDetails(path, maxAgeSeconds)]
+
+    def getTotalSize(self, path, maxAgeSeconds=None):
+        return sum(size for filePath, size, mtime, checksum in self.getFilesWithDetails(path, maxAgeSeconds))
+
+    def glob(self, pattern, maxAgeSeconds=None):
+        '''Returns the paths of the files matching a shell-style pattern, e.g. "/store/user/me/ntuples/*/*.root". As in the shell, wildcards do not match "/".'''
+        if not(pattern.startswith("/")): sys.exit("ERROR in tmListingIndex.glob: pattern must be an absolute path. Pattern: {p}".format(p=pattern))
+        pattern = normalizePath(pattern)
+        firstSpecialCharacterIndex = min([len(pattern)] + [pattern.index(character) for character in GLOB_SPECIAL_CHARACTERS if (character in pattern)])
+        basePath = normalizePath(pattern[:1+pattern.rfind("/", 0, firstSpecialCharacterIndex)]) # directory containing the first wildcard, or the file itself
+        self.ensureFresh(basePath, maxAgeSeconds)
+        if (firstSpecialCharacterIndex == len(pattern)): # no wildcards
+            return [filePath for (filePath,) in self.connection.execute("SELECT path FROM entries WHERE isDirectory = 0 AND path = ?", (pattern,))]
+        subtreePrefix = joinPath(basePath, "")
+        patternComponents = pattern.split("/")
+        matchingFilePaths = []
+        for (filePath,) in self.connection.execute("SELECT path FROM entries WHERE isDirectory = 0 AND path >= ? AND path < ? ORDER BY path", (subtreePrefix, subtreePrefix[:-1] + "0")):
+            filePathComponents = filePath.split("/")
+            if ((len(filePathComponents) == len(patternComponents)) and all(fnmatch.fnmatchcase(filePathComponent, patternComponent) for filePathComponent, patternComponent in zip(filePathComponents, patternComponents))): matchingFilePaths.append(filePath)
+        return matchingFilePaths
+
+def get_eos_listing_index(databasePath, maxAgeSeconds=3600.):
+    import tmEOSUtils
+    return tmListingIndex(databasePath=databasePath, listDirectoryFunction=tmEOSUtils.list_eos_directory, maxAgeSeconds=maxAgeSeconds)
+
+def get_xrootd_listing_index(databasePath, xrd_prefix, fetchChecksums=True, maxAgeSeconds=3600., maxConcurrentChecksums=None):
+    import tmXRootUtils
+    checksumFunction = None
+    if fetchChecksums: checksumFunction = (lambda file_path: tmXRootUtils.Query_xrdfs_adler32_WithRetries(xrd_prefix, file_path, tmXRootUtils.DEFAULT_MAX_RETRIES, tmXRootUtils.DEFAULT_RETRY_BACKOFF_SECONDS))
+    if (maxConcurrentChecksums is None): maxConcurrentChecksums = tmXRootUtils.DEFAULT_MAX_PARALLEL_QUERIES
+    return tmListingIndex(databasePath=databasePath, listDirectoryFunction=(lambda directory_path: tmXRootUtils.List_xrdfs_Directory(xrd_prefix, directory_path)), checksumFunction=checksumFunction, maxAgeSeconds=maxAgeSeconds, maxConcurrentChecksums=maxConcurrentChecksums)
+
+def test():
+    listingIndex = get_xrootd_listing_index(databasePath="test_tmListingIndex.sqlite", xrd_prefix="root://cmseos.fnal.gov")
+    listingIndex.refresh("/store/user/tmudholk/test", printVerbose=True)
+    for file_details in listingIndex.getFilesWithDetails("/store/user/tmudholk/test"):
+        print("Found: {d}".format(d=file_details))
+    print("Total size: {s}".format(s=listingIndex.getTotalSize("/store/user/tmudholk/test")))
+    print("ROOT files: {f}".format(f=listingIndex.glob("/store/user/tmudholk/test/*.root")))
+    listingIndex.refresh("/store/user/tmudholk/test", printVerbose=True) # should only need one listing if nothing changed
+    listingIndex.close()
+
+if __name__ == "__main__":
+    test()
@@ -1,36 +1,167 @@
 from __future__ import print_function, division
 
-import os, sys, subprocess, time, signal, tmGeneralUtils, pdb
+import os, sys, subprocess, time, signal, threading, queue, heapq, json, hashlib, resource, tmGeneralUtils, pdb
+
+TAIL_FLUSH_TIME_SECONDS = 0.5
+RESOURCE_USAGE_FILE_NAME = "resourceUsage.json"
+DEFAULT_RETRY_BACKOFF_SECONDS = 30.
+DEFAULT_ESTIMATED_DURATION_SECONDS = 1. # for jobs without an estimate, so that the critical path length counts the number of steps
+RSS_SAMPLING_INTERVAL_SECONDS = 1.
+
+def getProcessTreePids(pid):
+    # pid and all of its descendants, from /proc/<pid>/task/<tid>/children; processes that exit in the meantime are skipped
+    processTreePids = []
+    pidsToVisit = [pid]
+    while (len(pidsToVisit) > 0):
+        currentPid = pidsToVisit.pop()
+        processTreePids.append(currentPid)
+        try:
+            for tid in os.listdir("/proc/{p}/task".format(p=currentPid)):
+                with open("/proc/{p}/task/{t}/children".format(p=currentPid, t=tid), 'r') as childrenFileHandle:
+                    pidsToVisit.extend(int(childPid) for childPid in childrenFileHandle.read().split())
+        except (OSError, ValueError):
+            continue
+    return processTreePids
+
+def getProcessTreeRSSKB(pid):
+    # Returns (current RSS summed over the process tree, largest peak RSS of any single process in it), in kB, from /proc/<pid>/status
+    totalRSSKB = 0
+    maxPeakRSSKB = 0
+    for processTreePid in getProcessTreePids(pid):
+        try:
+            with open("/proc/{p}/status".format(p=processTreePid), 'r') as statusFileHandle:
+                for line in statusFileHandle:
+                    if line.startswith("VmRSS:"): totalRSSKB += int(line.split()[1])
+                    elif line.startswith("VmHWM:"): maxPeakRSSKB = max(maxPeakRSSKB, int(line.split()[1]))
+        except (OSError, ValueError):
+            continue
+    return (totalRSSKB, maxPeakRSSKB)
+
+def getReturnCodeFromWaitStatus(waitStatus):
+    # Same convention as subprocess: negative signal number if the process was killed by a signal
+    if os.WIFSIGNALED(waitStatus): return -os.WTERMSIG(waitStatus)
+    return os.WEXITSTATUS(waitStatus)
 
 class tmMultiProcessLauncher:
-    def __init__(self, logOutputFolder=None, monitorUpdateTimeSeconds=10, enableStrictErrorDetection=True, printDebug=False):
+    def __init__(self, logOutputFolder=None, monitorUpdateTimeSeconds=10, enableStrictErrorDetection=True, maxParallel=None, maxMemoryMB=None, completionJournalPath=None, printDebug=False):
+        # maxParallel limits the sum of the cpuWeights of the running processes, maxMemoryMB the sum of their memoryWeightMBs; None means no limit.
+        # Processes that do not fit are queued, and started in order of decreasing priority as running processes finish.
+        # Jobs can depend on others (by log file name); they are started as soon as all their dependencies have succeeded, most critical first.
+        # With maxParallel or maxMemoryMB set, jobs are only started by monitorToCompletion, once the whole dependency graph is known.
+        # If completionJournalPath is set, every successful job is recorded there, and jobs already recorded with the same log file name and command are not run again.
         self.logOutputFolder = ""
         if not(logOutputFolder is None): self.logOutputFolder = logOutputFolder
         self.monitorUpdateTimeSeconds = monitorUpdateTimeSeconds
         self.enableStrictErrorDetection = enableStrictErrorDetection
-        self.processes_list = []
+        self.maxParallel = maxParallel
+        self.maxMemoryMB = maxMemoryMB
+        self.processes_list = [] # running processes
+        self.queuedJobs = [] # heap of (-priority, -critical path length, submission index, job)
+        self.blockedJobs = {} # log file name -> job, for jobs waiting for their dependencies
+        self.succeededLogFileNames = set() # over all calls to monitorToCompletion, including jobs skipped thanks to the completion journal
+        self.delayedJobs = [] # heap of (time at which to requeue, submission index, job), for jobs waiting to be retried
+        self.nSubmittedJobs = 0
+        self.skippedJobs = {} # log file name -> job, for jobs found in the completion journal; run after all if one of their dependencies runs again
+        self.completionJournalPath = completionJournalPath
+        self.completedCommandHashes = {} # log file name -> hash of the command with which it last succeeded
+        if not(self.completionJournalPath is None): self.completedCommandHashes = self.readCompletionJournal()
         self.monitoring_process_handle = None
+        self.completionsQueue = queue.Queue() # log file names of processes that have terminated, filled by one waiter thread per process
+        self.processesLock = threading.Lock() # guards "hasTerminated", so that killAll never signals a process that has already been reaped
+        self.resourceUsages = {} # log file name -> wall time, CPU times and peak RSS of each finished process
         self.tail_command = "tail -f"
         # Check if "multitail" exists
         multitail_version_command_exit_status = subprocess.call("multitail -V", shell=True, executable="/bin/bash")
         if (multitail_version_command_exit_status == 0): self.tail_command = "multitail"
         else: print("WARNNING: multitail not found, using usual tail -f.")
 
+    def stopMonitoringProcess(self, flushTimeSeconds=TAIL_FLUSH_TIME_SECONDS):
+        if (self.monitoring_process_handle is None): return
+        time.sleep(flushTimeSeconds) # give tail a moment to print the last lines written to the logs
+        if (self.monitoring_process_handle.poll() is None): self.monitoring_process_handle.send_signal(signal.SIGINT)
+        try:
+            self.monitoring_process_handle.wait(timeout=TAIL_FLUSH_TIME_SECONDS)
+        except subprocess.TimeoutExpired:
+            self.monitoring_process_handle.kill()
+            self.monitoring_process_handle.wait()
+        self.monitoring_process_handle = None
+
+    def readCompletionJournal(self):
+        completedCommandHashes = {}
+        if not(os.path.isfile(self.completionJournalPath)): return completedCommandHashes
+        with open(self.completionJournalPath, 'r') as completionJournalFileHandle:
+            for line in completionJournalFileHandle:
+                if (len(line.strip()) == 0): continue
+                try:
+                    journalEntry = json.loads(line)
+                except ValueError: # e.g. last line truncated by an interrupted run
+                    continue
+                completedCommandHashes[journalEntry["logFileName"]] = journalEntry["commandHash"]
+        return completedCommandHashes
+
+    def recordCompletion(self, job):
+        if (self.completionJournalPath is None): return
+        with open(self.completionJournalPath, 'a') as completionJournalFileHandle:
+            completionJournalFileHandle.write(json.dumps({"logFileName": job["logFileName"], "commandHash": job["commandHash"], "timeCompleted": time.time()}) + "\n")
+        self.completedCommandHashes[job["logFileName"]] = job["commandHash"]
+
     def killAll(self):
-        if not(self.monitoring_process_handle is None): self.monitoring_process_handle.send_signal(signal.SIGINT)
-        for process in self.processes_list:
-            processHandle = process["processHandle"]
-            if (not(processHandle is None) and (processHandle.poll() is None)): processHandle.kill()
+        self.queuedJobs = []
+        self.delayedJobs = []
+        self.blockedJobs = {}
+        with self.processesLock:
+            for process in self.processes_list:
+                if not(process["hasTerminated"]): os.kill(process["processHandle"].pid, signal.SIGKILL)
+        self.stopMonitoringProcess()
+
+    def sampleProcessTreeRSS(self, process, stopEvent):
+        # Runs next to waitForProcess. VmHWM is reset by exec, so unlike ru_maxrss it does not include the launcher's memory, copied into the child by fork.
+        # Processes that start and exit between two samples are missed.
+        while True:
+            totalRSSKB, maxPeakRSSKB = getProcessTreeRSSKB(process["processHandle"].pid)
+            process["sampledPeakRSSKB"] = max(process["sampledPeakRSSKB"], totalRSSKB, maxPeakRSSKB)
+            if stopEvent.wait(RSS_SAMPLING_INTERVAL_SECONDS): break
 
-    def spawn(self, shellCommands=None, optionalEnvSetup=None, logFileName=None, printDebug=False):
+    def waitForProcess(self, process):
+        # Runs in a separate thread for each process, so that the monitor learns about terminations as soon as they happen.
+        # os.wait4 also returns the resource usage of the process, including that of the children it waited for (bash waits for all of them).
+        # Its ru_maxrss is at least the launcher's RSS when it forked the process, so the peak RSS is taken from /proc samples of the process tree instead,
+        # and from ru_maxrss only if it exceeds the launcher's peak RSS at spawn time, in which case it must come from the job itself.
+        processHandle = process["processHandle"]
+        samplerStopEvent = threading.Event()
+        samplerThread = threading.Thread(target=self.sampleProcessTreeRSS, args=(process, samplerStopEvent))
+        samplerThread.daemon = True
+        samplerThread.start()
+        os.waitid(os.P_PID, processHandle.pid, os.WEXITED | os.WNOWAIT) # not reaped yet, so that the sampler cannot read the /proc entries of a reused pid
+        samplerStopEvent.set()
+        samplerThread.join()
+        pid, waitStatus, resourceUsage = os.wait4(processHandle.pid, 0)
+        wallTimeSeconds = time.time() - process["startTime"]
+        peakRSSKB = process["sampledPeakRSSKB"]
+        isPeakRSSReliable = (resourceUsage.ru_maxrss > process["launcherPeakRSSKB"])
+        if isPeakRSSReliable: peakRSSKB = max(peakRSSKB, resourceUsage.ru_maxrss)
+        with self.processesLock:
+            process["hasTerminated"] = True
+            processHandle.returncode = getReturnCodeFromWaitStatus(waitStatus)
+        process["resourceUsage"] = {"wallTimeSeconds": wallTimeSeconds,
+                                    "userCPUTimeSeconds": resourceUsage.ru_utime,
+                                    "systemCPUTimeSeconds": resourceUsage.ru_stime,
+                                    "peakRSSMB": peakRSSKB/1024., # kB on Linux
+                                    "isPeakRSSReliable": isPeakRSSReliable, # if False, short-lived processes between samples may have used more
+                                    "returnCode": processHandle.returncode}
+        self.completionsQueue.put(process["logFileName"])
+
+    def spawn(self, shellCommands=None, optionalEnvSetup=None, logFileName=None, cpuWeight=1, memoryWeightMB=0, priority=0, maxRetries=0, retryBackoffSeconds=DEFAULT_RETRY_BACKOFF_SECONDS, dependsOn=None, estimatedDurationSeconds=None, printDebug=False):
+        # A failed job is run again up to maxRetries times; the n-th retry starts retryBackoffSeconds*2^(n-1) seconds after the failure.
+        # dependsOn: log file names of the jobs that must succeed before this one starts. They can be spawned before or after this job.
+        # estimatedDurationSeconds is only used to find the critical path: among jobs of equal priority, those with the longest chain of work after them start first.
         if ((shellCommands is None) or (logFileName is None)
             or (shellCommands == "") or (logFileName == "")
             or (shellCommands == [])): sys.exit("ERROR in tmProcessLauncher: both shellCommands to launch and logFileName must be specified. Currently, shellCommands={sC}, logFileName={lFN}".format(sC=shellCommands, lFN=logFileName))
-        logFilesList = [process["logFileName"] for process in self.processes_list]
+        logFilesList = [process["logFileName"] for process in self.processes_list] + [queuedJob[-1]["logFileName"] for queuedJob in self.queuedJobs] + [delayedJob[-1]["logFileName"] for delayedJob in self.delayedJobs] + list(self.blockedJobs.keys()) + list(self.skippedJobs.keys())
         if logFileName in logFilesList:
             self.killAll()
             sys.exit("ERROR: duplicate log file name: {lFN}".format(lFN=logFileName))
-        outputFileHandle = open("{lOF}/{lFN}".format(lOF=self.logOutputFolder, lFN=logFileName), 'w')
         formattedShellCommand = "set -x && "
         if not(optionalEnvSetup is None): formattedShellCommand = "{oES} && echo \"env setup done.\" && set -x && ".format(oES=optionalEnvSetup)
         if isinstance(shellCommands, list):
@@ -38,10 +169,152 @@ class tmMultiProcessLauncher:
         else:
             formattedShellCommand += shellCommands
         formattedShellCommand += " && set +x"
-        if printDebug: print("Spawning process with command: {fSC}".format(fSC=formattedShellCommand))
-        processHandle = subprocess.Popen(formattedShellCommand, stdout=outputFileHandle, stderr=outputFileHandle, shell=True, executable="/bin/bash")
-        self.processes_list.append({"logFileName": logFileName,
-                                    "processHandle": processHandle})
+        commandHash = hashlib.sha256(formattedShellCommand.encode()).hexdigest()
+        if (estimatedDurationSeconds is None): estimatedDurationSeconds = DEFAULT_ESTIMATED_DURATION_SECONDS
+        job = {"logFileName": logFileName,
+               "formattedShellCommand": formattedShellCommand,
+               "commandHash": commandHash,
+               "cpuWeight": cpuWeight,
+               "memoryWeightMB": memoryWeightMB,
+               "priority": priority,
+               "submissionIndex": self.nSubmittedJobs,
+               "maxRetries": maxRetries,
+               "retryBackoffSeconds": retryBackoffSeconds,
+               "nAttempts": 0,
+               "dependsOn": ([] if (dependsOn is None) else list(dependsOn)),
+               "estimatedDurationSeconds": estimatedDurationSeconds,
+               "criticalPathSeconds": estimatedDurationSeconds}
+        self.nSubmittedJobs += 1
+        pendingJobs = self.getPendingJobs()
+        if ((self.completedCommandHashes.get(logFileName) == commandHash) and not(any((dependency in pendingJobs) for dependency in job["dependsOn"]))):
+            print("Job with log {lFN} already completed with the same command, skipping.".format(lFN=logFileName))
+            self.skippedJobs[logFileName] = job
+            self.succeededLogFileNames.add(logFileName)
+            return
+        # A skipped dependency may still have to run, if one of its own dependencies is spawned later: this is only settled in monitorToCompletion
+        if all(((dependency in self.succeededLogFileNames) and not(dependency in self.skippedJobs)) for dependency in job["dependsOn"]): self.queueJob(job)
+        else: self.blockedJobs[logFileName] = job
+        if ((self.maxParallel is None) and (self.maxMemoryMB is None)): self.startQueuedJobs(printDebug=printDebug)
+
+    def queueJob(self, job):
+        heapq.heappush(self.queuedJobs, (-job["priority"], -job["criticalPathSeconds"], job["submissionIndex"], job))
+
+    def getPendingJobs(self):
+        # All jobs that have not finished yet, by log file name
+        pendingJobs = {}
+        for process in self.processes_list: pendingJobs[process["logFileName"]] = process["job"]
+        for queuedJob in self.queuedJobs: pendingJobs[queuedJob[-1]["logFileName"]] = queuedJob[-1]
+        for delayedJob in self.delayedJobs: pendingJobs[delayedJob[-1]["logFileName"]] = delayedJob[-1]
+        pendingJobs.update(self.blockedJobs)
+        return pendingJobs
+
+    def runSkippedJobsWithPendingDependencies(self):
+        # Outputs of skipped jobs are stale if any of their dependencies, direct or not, runs again
+        pendingJobs = self.getPendingJobs()
+        while True:
+            logFileNamesToRun = [logFileName for logFileName, job in self.skippedJobs.items() if any((dependency in pendingJobs) for dependency in job["dependsOn"])]
+            if (len(logFileNamesToRun) == 0): break
+            for logFileName in logFileNamesToRun:
+                print("Job with log {lFN} already completed, but will run again because one of its dependencies does.".format(lFN=logFileName))
+                job = self.skippedJobs.pop(logFileName)
+                self.succeededLogFileNames.discard(logFileName)
+                self.blockedJobs[logFileName] = job
+                pendingJobs[logFileName] = job
+
+    def checkDependenciesAndSetCriticalPaths(self):
+        self.runSkippedJobsWithPendingDependencies()
+        pendingJobs = self.getPendingJobs()
+        dependents = {logFileName: [] for logFileName in pendingJobs}
+        for logFileName, job in pendingJobs.items():
+            for dependency in job["dependsOn"]:
+                if (dependency in self.succeededLogFileNames): continue
+                if not(dependency in pendingJobs):
+                    self.killAll()
+                    sys.exit("ERROR: job with log {lFN} depends on {d}, which has not been spawned or has failed.".format(lFN=logFileName, d=dependency))
+                dependents[dependency].append(logFileName)
+        # Depth-first search from every job: finds cycles, and sets the critical path length (the job's own duration plus the longest chain of dependents) in post-order
+        visitStates = {} # log file name -> "inProgress" or "done"
+        for startLogFileName in pendingJobs:
+            if (startLogFileName in visitStates): continue
+            visitStates[startLogFileName] = "inProgress"
+            stack = [(startLogFileName, iter(dependents[startLogFileName]))]
+            while (len(stack) > 0):
+                logFileName, dependentsIterator = stack[-1]
+                nextDependent = next(dependentsIterator, None)
+                if (nextDependent is None):
+                    stack.pop()
+                    visitStates[logFileName] = "done"
+                    pendingJobs[logFileName]["criticalPathSeconds"] = pendingJobs[logFileName]["estimatedDurationSeconds"] + max([0.] + [pendingJobs[dependent]["criticalPathSeconds"] for dependent in dependents[logFileName]])
+                elif (visitStates.get(nextDependent) == "inProgress"):
+                    self.killAll()
+                    cycle = [stackEntry[0] for stackEntry in stack[[stackEntry[0] for stackEntry in stack].index(nextDependent):]] + [nextDependent]
+                    sys.exit("ERROR: circular dependency between jobs, each of which depends on the next one: {c}".format(c=" -> ".join(reversed(cycle))))
+                elif not(nextDependent in visitStates):
+                    visitStates[nextDependent] = "inProgress"
+                    stack.append((nextDependent, iter(dependents[nextDependent])))
+        self.queuedJobs = [(-job["priority"], -job["criticalPathSeconds"], job["submissionIndex"], job) for negativePriority, negativeCriticalPathSeconds, submissionIndex, job in self.queuedJobs]
+        heapq.heapify(self.queuedJobs)
+
+    def queueUnblockedJobs(self):
+        for logFileName in [logFileName for logFileName, job in self.blockedJobs.items() if all((dependency in self.succeededLogFileNames) for dependency in job["dependsOn"])]:
+            self.queueJob(self.blockedJobs.pop(logFileName))
+
+    def removeDependentsOfFailedJob(self, failedLogFileName, returnStatuses):
+        # Dependents, direct or not, of a job that has failed will never run
+        failedLogFileNames = [failedLogFileName]
+        while (len(failedLogFileNames) > 0):
+            failedLogFileName = failedLogFileNames.pop()
+            for logFileName in [logFileName for logFileName, job in self.blockedJobs.items() if (failedLogFileName in job["dependsOn"])]:
+                del self.blockedJobs[logFileName]
+                returnStatuses[logFileName] = "not run, dependency {d} failed".format(d=failedLogFileName)
+                failedLogFileNames.append(logFileName)
+
+    def queueReadyDelayedJobs(self):
+        while ((len(self.delayedJobs) > 0) and (self.delayedJobs[0][0] <= time.time())):
+            timeReady, submissionIndex, job = heapq.heappop(self.delayedJobs)
+            self.queueJob(job)
+
+    def startJob(self, job, printDebug=False):
+        if printDebug: print("Spawning process with command: {fSC}".format(fSC=job["formattedShellCommand"]))
+        job["nAttempts"] += 1
+        if (job["nAttempts"] == 1):
+            outputFileHandle = open("{lOF}/{lFN}".format(lOF=self.logOutputFolder, lFN=job["logFileName"]), 'w')
+        else: # keep the logs of the earlier attempts
+            outputFileHandle = open("{lOF}/{lFN}".format(lOF=self.logOutputFolder, lFN=job["logFileName"]), 'a')
+            outputFileHandle.write("\n{d} Attempt {n} {d}\n".format(d="="*20, n=job["nAttempts"]))
+            outputFileHandle.flush()
+        processHandle = subprocess.Popen(job["formattedShellCommand"], stdout=outputFileHandle, stderr=outputFileHandle, shell=True, executable="/bin/bash")
+        launcherPeakRSSKB = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss # after the fork, so at least the RSS the child started with
+        outputFileHandle.close() # the child has its own copy
+        process = {"logFileName": job["logFileName"],
+                   "job": job,
+                   "processHandle": processHandle,
+                   "startTime": time.time(),
+                   "hasTerminated": False,
+                   "launcherPeakRSSKB": launcherPeakRSSKB,
+                   "sampledPeakRSSKB": 0,
+                   "cpuWeight": job["cpuWeight"],
+                   "memoryWeightMB": job["memoryWeightMB"]}
+        self.processes_list.append(process)
+        waiterThread = threading.Thread(target=self.waitForProcess, args=(process,))
+        waiterThread.daemon = True
+        waiterThread.start()
+
+    def canStart(self, job):
+        # A job larger than the limits is still started once nothing else is running
+        if (len(self.processes_list) == 0): return True
+        if (not(self.maxParallel is None) and (sum(process["cpuWeight"] for process in self.processes_list) + job["cpuWeight"] > self.maxParallel)): return False
+        if (not(self.maxMemoryMB is None) and (sum(process["memoryWeightMB"] for process in self.processes_list) + job["memoryWeightMB"] > self.maxMemoryMB)): return False
+        return True
+
+    def startQueuedJobs(self, printDebug=False):
+        # Strictly in order of priority: a job that does not fit blocks the lower priority ones, so that large jobs are not starved. Returns the number of jobs started.
+        nStarted = 0
+        while ((len(self.queuedJobs) > 0) and self.canStart(self.queuedJobs[0][-1])):
+            job = heapq.heappop(self.queuedJobs)[-1]
+            self.startJob(job, printDebug=printDebug)
+            nStarted += 1
+        return nStarted
 
     def generateTailCommand(self, printDebug=False):
         tailCommand = self.tail_command
@@ -54,39 +327,84 @@ class tmMultiProcessLauncher:
         return tailCommand
 
     def monitorToCompletion(self, killAllOnOneFailure=True, printDebug=False):
-        print("Starting to monitor {n} processes:".format(n=len(self.processes_list)))
-        oneOrMoreProcessesActive = True
-        self.monitoring_process_handle = subprocess.Popen(self.generateTailCommand(printDebug=printDebug), shell=True, executable="/bin/bash")
+        print("Starting to monitor {n} processes ({q} of them queued, {b} waiting for dependencies):".format(n=len(self.processes_list) + len(self.queuedJobs) + len(self.blockedJobs), q=len(self.queuedJobs), b=len(self.blockedJobs)))
+        self.checkDependenciesAndSetCriticalPaths()
+        self.queueUnblockedJobs()
+        self.startQueuedJobs(printDebug=printDebug)
+        if (len(self.processes_list) > 0): self.monitoring_process_handle = subprocess.Popen(self.generateTailCommand(printDebug=printDebug), shell=True, executable="/bin/bash")
         returnStatuses = {}
-        while oneOrMoreProcessesActive:
-            time.sleep(self.monitorUpdateTimeSeconds)
-            # print("\n"*5)
-            oneOrMoreProcessesActive = False
-            processesToRemove = []
-            for process in self.processes_list:
-                oneOrMoreProcessesActive = True
+        for logFileName in self.skippedJobs:
+            returnStatuses[logFileName] = "skipped, already completed"
+        while ((len(self.processes_list) > 0) or (len(self.queuedJobs) > 0) or (len(self.delayedJobs) > 0) or (len(self.blockedJobs) > 0)):
+            waitTimeSeconds = self.monitorUpdateTimeSeconds
+            if (len(self.delayedJobs) > 0): waitTimeSeconds = max(0., min(waitTimeSeconds, self.delayedJobs[0][0] - time.time()))
+            try:
+                finishedLogFileNames = [self.completionsQueue.get(timeout=waitTimeSeconds)]
+            except queue.Empty:
+                finishedLogFileNames = []
+                if printDebug: print("Still waiting for: {l}; {q} processes queued, {d} waiting to be retried, {b} waiting for dependencies.".format(l=[process["logFileName"] for process in self.processes_list], q=len(self.queuedJobs), d=len(self.delayedJobs), b=len(self.blockedJobs)))
+            while True: # collect everything else that has finished in the meantime, so that the tail is restarted only once
+                try:
+                    finishedLogFileNames.append(self.completionsQueue.get_nowait())
+                except queue.Empty:
+                    break
+            for process in [process for process in self.processes_list if (process["logFileName"] in finishedLogFileNames)]:
+                (self.processes_list).remove(process)
                 logFileName = process["logFileName"]
-                processHandle = process["processHandle"]
-                if ((processHandle is None) or not((processHandle.poll() is None))): # Process has terminated
-                    processesToRemove.append(process)
-                    returnStatuses[logFileName] = processHandle.returncode
-                    if (self.enableStrictErrorDetection):
-                        if (returnStatuses[logFileName] != 0):
-                            if killAllOnOneFailure:
-                                self.killAll()
-                            time.sleep(self.monitorUpdateTimeSeconds) # seems to be required between killAll and next line, maybe to clear buffer or something?
-                            if killAllOnOneFailure:
-                                sys.exit("ERROR in process with log: {lOF}/{lFN}. Return code: {r}".format(lOF=self.logOutputFolder, lFN=logFileName, r=returnStatuses[logFileName]))
-            if (len(processesToRemove) > 0):
-                for process in processesToRemove:
-                    (self.processes_list).remove(process)
-                if (self.tail_command == "multitail"): # Restart the monitoring process with only the remaining processes
-                    self.monitoring_process_handle.send_signal(signal.SIGINT)
-                    if (len(self.processes_list) > 0): self.monitoring_process_handle = subprocess.Popen(self.generateTailCommand(printDebug=printDebug), shell=True, executable="/bin/bash")
+                returnStatuses[logFileName] = process["processHandle"].returncode
+                self.resourceUsages[logFileName] = process["resourceUsage"]
+                self.resourceUsages[logFileName]["nAttempts"] = process["job"]["nAttempts"]
+                if (returnStatuses[logFileName] == 0):
+                    self.recordCompletion(process["job"])
+                    self.succeededLogFileNames.add(logFileName)
+                    continue
+                if (process["job"]["nAttempts"] <= process["job"]["maxRetries"]):
+                    retryDelaySeconds = process["job"]["retryBackoffSeconds"]*pow(2, process["job"]["nAttempts"] - 1)
+                    print("WARNING: error in process with log: {lOF}/{lFN}. Return code: {r}. Retrying in {t:.1f} s.".format(lOF=self.logOutputFolder, lFN=logFileName, r=returnStatuses[logFileName], t=retryDelaySeconds))
+                    heapq.heappush(self.delayedJobs, (time.time() + retryDelaySeconds, process["job"]["submissionIndex"], process["job"]))
+                    del returnStatuses[logFileName]
+                    continue
+                self.removeDependentsOfFailedJob(logFileName, returnStatuses)
+                if self.enableStrictErrorDetection:
+                    if killAllOnOneFailure:
+                        self.killAll()
+                        self.saveResourceUsages()
+                        sys.exit("ERROR in process with log: {lOF}/{lFN}. Return code: {r}".format(lOF=self.logOutputFolder, lFN=logFileName, r=returnStatuses[logFileName]))
+                    print("WARNING: error in process with log: {lOF}/{lFN}. Return code: {r}".format(lOF=self.logOutputFolder, lFN=logFileName, r=returnStatuses[logFileName]))
+            self.queueReadyDelayedJobs()
+            self.queueUnblockedJobs()
+            nStarted = self.startQueuedJobs(printDebug=printDebug)
+            if (((nStarted > 0) or ((len(finishedLogFileNames) > 0) and (self.tail_command == "multitail"))) and (len(self.processes_list) > 0)): # Restart the monitoring process with only the running processes, if they have changed
+                self.stopMonitoringProcess(flushTimeSeconds=0.)
+                self.monitoring_process_handle = subprocess.Popen(self.generateTailCommand(printDebug=printDebug), shell=True, executable="/bin/bash")
+        self.stopMonitoringProcess()
         print("All processes finished!")
         print("Return statuses:")
         tmGeneralUtils.prettyPrintDictionary(inputDict=returnStatuses)
-        time.sleep(self.monitorUpdateTimeSeconds)
+        self.printResourceUsages(logFileNames=[logFileName for logFileName in returnStatuses.keys() if ((logFileName in self.resourceUsages) and not(logFileName in self.skippedJobs))])
+        self.skippedJobs = {}
+        self.saveResourceUsages()
+
+    def printResourceUsages(self, logFileNames=None):
+        # Most expensive processes first, by wall time; for retried processes, only the last attempt is shown
+        if (logFileNames is None): logFileNames = list(self.resourceUsages.keys())
+        if (len(logFileNames) == 0): return
+        nameLength = 3 + max(len(logFileName) for logFileName in logFileNames)
+        print("Resource usage:")
+        print("{n}{w:>12}{u:>12}{s:>12}{r:>14}".format(n=tmGeneralUtils.alignFixedWidthStringLeft(nameLength, "log"), w="wall (s)", u="user (s)", s="sys (s)", r="peak RSS (MB)"))
+        for logFileName in sorted(logFileNames, key=(lambda logFileName: self.resourceUsages[logFileName]["wallTimeSeconds"]), reverse=True):
+            resourceUsage = self.resourceUsages[logFileName]
+            print("{n}{w:>12.1f}{u:>12.1f}{s:>12.1f}{r:>14}".format(n=tmGeneralUtils.alignFixedWidthStringLeft(nameLength, logFileName), w=resourceUsage["wallTimeSeconds"], u=resourceUsage["userCPUTimeSeconds"], s=resourceUsage["systemCPUTimeSeconds"], r="{p:.1f}{f}".format(p=resourceUsage["peakRSSMB"], f=("" if resourceUsage["isPeakRSSReliable"] else "*"))))
+        if not(all(self.resourceUsages[logFileName]["isPeakRSSReliable"] for logFileName in logFileNames)): print("*: from samples every {i:.1f} s; processes shorter than that may be missed.".format(i=RSS_SAMPLING_INTERVAL_SECONDS))
+
+    def saveResourceUsages(self):
+        # Accumulates over all calls to monitorToCompletion
+        if (len(self.resourceUsages) == 0): return
+        resourceUsageFilePath = RESOURCE_USAGE_FILE_NAME
+        if not(self.logOutputFolder == ""): resourceUsageFilePath = "{lOF}/{rUFN}".format(lOF=self.logOutputFolder, rUFN=RESOURCE_USAGE_FILE_NAME)
+        with open(resourceUsageFilePath, 'w') as resourceUsageFileHandle:
+            json.dump(self.resourceUsages, resourceUsageFileHandle, indent=4, sort_keys=True)
+        print("Resource usage saved to: {f}".format(f=resourceUsageFilePath))
 
 if __name__ == "__main__":
     print("Launching test for tmMultiProcessLauncher...")
@@ -104,6 +422,11 @@ if __name__ == "__main__":
     # multiProcessLauncher.spawn(shellCommands="echo test sleeping 59 && sleep 59 && echo slept 59", logFileName="sleeper_59.log", printDebug=True) # should break due to duplicate log
     # multiProcessLauncher.monitorToCompletion(printDebug=True)
 
+    # multiProcessLauncher.spawn(shellCommands="echo sleeping 20 && sleep 20 && echo slept 20", logFileName="stage2.log", dependsOn=["stage1.log"], printDebug=True) # should start right after stage1.log, without waiting for sleeper_40.log
+    # multiProcessLauncher.spawn(shellCommands="echo sleeping 10 && sleep 10 && echo slept 10", logFileName="stage1.log", printDebug=True)
+    # multiProcessLauncher.spawn(shellCommands="echo sleeping 40 && sleep 40 && echo slept 40", logFileName="sleeper_40.log", printDebug=True)
+    # multiProcessLauncher.monitorToCompletion(printDebug=True)
+
     multiProcessLauncher.spawn(shellCommands="echo sleeping 30 && sleep 30 && echo slept 30", logFileName="sleeper_30.log", printDebug=True)
     multiProcessLauncher.spawn(shellCommands="echo sleeping 60 && sleep 60 && echo slept 60", logFileName="sleeper_60.log", printDebug=True)
     multiProcessLauncher.spawn(shellCommands="echo sleeping 65 && sleep 65 && echo slept 65", logFileName="sleeper_65.log", printDebug=True)
@@ -1,7 +1,7 @@
 #!/usr/bin/env python
 
 from __future__ import print_function, division
-import os, sys, argparse, pdb, math, json, subprocess
+import os, sys, argparse, pdb, math, json, subprocess, time, traceback, multiprocessing, concurrent.futures
 import tmGeneralUtils, tmROOTUtils
 
 # Register command line options
@@ -9,6 +9,9 @@ inputArgumentsParser = argparse.ArgumentParser(description='General tool to gene
 inputArgumentsParser.add_argument('--inputFilePath', required=True, help='Path to input JSON.',type=str)
 inputArgumentsParser.add_argument('--userString', default="", help='The set of characters \"{uS}\" in the input JSON is replaced with the value of this argument.',type=str)
 inputArgumentsParser.add_argument('--printTemplate', action='store_true', help="Only print template for a skeleton JSON file and exit.")
+inputArgumentsParser.add_argument('--jobs', default=1, help='Number of worker processes across which to spread the targets. With the default value of 1, targets are processed serially and the first failure aborts the run; with more than 1, failures are reported at the end without stopping the remaining targets.',type=int)
+inputArgumentsParser.add_argument('--maxOpenFiles', default=tmROOTUtils.DEFAULT_MAX_OPEN_FILES, help='Maximum number of input ROOT files kept open at once (per worker) for reuse across targets.',type=int)
+inputArgumentsParser.add_argument('--maxCachedHistograms', default=tmROOTUtils.DEFAULT_MAX_CACHED_HISTOGRAMS, help='Maximum number of input histograms kept in memory (per worker) for reuse across targets.',type=int)
 inputArguments = inputArgumentsParser.parse_args()
 
 def getFormattedInputData(rawSource):
@@ -40,6 +43,7 @@ if inputArguments.printTemplate:
             "ratioDenominatorLabel": "signal", # label whose histogram is to be considered as the denominator while taking the ratio
             "ratioType": "pull", # can take exactly two arguments: "pull", in which case bottom plot displays (ratio-1)/ratioError, or "nominal", in which case bottom plot displays nominal ratio.
             "saveRatiosToFile": "false", # if set to "true", then ratios are saved separately in a text file given by the argument "saveRatiosFile"
+            "saveRatiosBinarySidecar": "false", # if set to "true", the ratios are also saved as arrays in saveRatiosFile + ".npz", which tmGeneralUtils.getConfigurationFromFile reads much faster
             "saveRatioPlotsToFile": "false", # if set to "true", then ratio plots are saved separately in a file given by the argument "saveRatioPlotsFile"
             "ratioYMin": "-0.5", # y range min of ratio plot
             "ratioYMax": "3.5", # y range max of ratio plot
@@ -200,34 +204,16 @@ def saveComparisons(target):
     suppress_histogram = {}
     for label in sources_order:
         print("Fetching histogram for label: {l}".format(l=label))
-        inputHistogram = ROOT.TH1F()
         if ("filePath" in inputDetails["sources"][label]):
-            inputFile = ROOT.TFile.Open(getFormattedInputData(inputDetails["sources"][label]["filePath"]), "READ")
-            if ((inputFile.IsZombie() == ROOT.kTRUE) or not(inputFile.IsOpen() == ROOT.kTRUE)):
-                sys.exit("ERROR in opening file: {f}".format(f=getFormattedInputData(inputDetails["sources"][label]["filePath"])))
-            inputFile.GetObject(str(inputDetails["sources"][label]["histogramName"]), inputHistogram)
-            if (not(inputHistogram)): sys.exit("Unable to find non-null histogram with name {n} in file {f}".format(n=str(inputDetails["sources"][label]["histogramName"]), f=getFormattedInputData(inputDetails["sources"][label]["filePath"])))
-            inputFile.Close()
+            inputHistogram = histogramsCache.getHistogram(getFormattedInputData(inputDetails["sources"][label]["filePath"]), str(inputDetails["sources"][label]["histogramName"]))
         elif ("combineSources" in str(inputDetails["sources"][label])):
             filePathHistNamePairs = getFormattedInputData(inputDetails["sources"][label]["combineSources"]).split(";")
             firstPairSplit = (filePathHistNamePairs[0]).split(":")
-            firstPair_inputFile = ROOT.TFile.Open(firstPairSplit[0], "READ")
-            if ((firstPair_inputFile.IsZombie() == ROOT.kTRUE) or not(firstPair_inputFile.IsOpen() == ROOT.kTRUE)):
-                sys.exit("ERROR in opening file: {f}".format(f=firstPairSplit[0]))
-            firstPair_inputFile.GetObject(str(firstPairSplit[1]), inputHistogram)
-            firstPair_inputFile.Close()
-            if (not(inputHistogram)): sys.exit("Unable to find non-null histogram with name {n} in file {f}".format(n=firstPairSplit[1], f=firstPairSplit[0]))
+            inputHistogram = histogramsCache.getHistogram(firstPairSplit[0], str(firstPairSplit[1]))
             remainingPairs = filePathHistNamePairs[1:]
             for pair in remainingPairs:
                 pairSplit = pair.split(":")
-                pair_inputFile = ROOT.TFile.Open(pairSplit[0], "READ")
-                if ((pair_inputFile.IsZombie() == ROOT.kTRUE) or not(pair_inputFile.IsOpen() == ROOT.kTRUE)):
-                    sys.exit("ERROR in opening file: {f}".format(f=pairSplit[0]))
-                inputHistogramTemp = ROOT.TH1F()
-                pair_inputFile.GetObject(str(pairSplit[1]), inputHistogramTemp)
-                if (not(inputHistogramTemp)): sys.exit("Unable to find non-null histogram with name {n} in file {f}".format(n=pairSplit[1], f=pairSplit[0]))
-                inputHistogram.Add(inputHistogramTemp)
-                pair_inputFile.Close()
+                inputHistogram.Add(histogramsCache.getHistogram(pairSplit[0], str(pairSplit[1]), returnClone=False))
         else:
             sys.exit("ERROR: Expected one of \"filePath\" or \"combineSources\" in input JSON source details for label: {l}, found neither.".format(l=label))
         inputHistogramsScaled[label] = inputHistogram.Clone()
@@ -261,7 +247,7 @@ def saveComparisons(target):
                 slopeScale = float(((getFormattedInputData(inputDetails["sources"][label]["slopeCorrection"])).split(":"))[2])
             except IndexError:
                 slopeScale = 1.0
-            slopeParameters = tmGeneralUtils.getConfigurationFromFile(inputFilePath=slopeFile)
+            slopeParameters = tmGeneralUtils.getCachedConfigurationFromFile(inputFilePath=slopeFile)
             slope = slopeParameters[slopeName]/slopeScale
             inputHistogramsScaled[label] = tmROOTUtils.getHistogramCorrectedBySlope(inputHistogram=inputHistogramsScaled[label], slope=slope, normX=float(str(inputDetails["normX"])))
 
@@ -271,6 +257,11 @@ def saveComparisons(target):
         saveRatiosToFile = (str(inputDetails["saveRatiosToFile"]) == "true")
     except KeyError:
         pass
+    saveRatiosBinarySidecar = False
+    try:
+        saveRatiosBinarySidecar = (str(inputDetails["saveRatiosBinarySidecar"]) == "true")
+    except KeyError:
+        pass
 
     # Make ratio plots and, if requested, save them in a file
     saveRatioPlotsToFile = False
@@ -363,7 +354,7 @@ def saveComparisons(target):
             if saveRatiosToFile:
                 fractionalUncertaintiesList.append(tuple(["float", (str(inputDetails["saveRatiosPatternDown"])).format(i=xCounter, l=label), fractionalErrorDown]))
                 fractionalUncertaintiesList.append(tuple(["float", (str(inputDetails["saveRatiosPatternUp"])).format(i=xCounter, l=label), fractionalErrorUp]))
-    if saveRatiosToFile: tmGeneralUtils.writeConfigurationParametersToFile(configurationParametersList=fractionalUncertaintiesList, outputFilePath=str(inputDetails["saveRatiosFile"]))
+    if saveRatiosToFile: tmGeneralUtils.writeConfigurationParametersToFile(configurationParametersList=fractionalUncertaintiesList, outputFilePath=str(inputDetails["saveRatiosFile"]), writeBinarySidecar=saveRatiosBinarySidecar)
 
     # Find maximum value for scaled histogram and the label that has it
     runningMaxValue = None
@@ -585,6 +576,72 @@ def saveComparisons(target):
 
     del ROOT, tdrstyle, CMS_lumi
 
+def initializeWorker():
+    # Every worker is a separate process with its own copy of the ROOT globals (gStyle, gROOT, ...), so targets running in parallel cannot clobber each other's style settings
+    import ROOT
+    ROOT.gROOT.SetBatch(ROOT.kTRUE)
+    ROOT.TH1.AddDirectory(ROOT.kFALSE)
+
+def saveComparisonsWithTiming(target):
+    # saveComparisons calls sys.exit on bad input; catch that here so that one broken target does not take down the rest of the batch
+    timeStarted = time.time()
+    errorMessage = None
+    try:
+        saveComparisons(target)
+    except SystemExit as exitException:
+        errorMessage = str(exitException.code)
+    except Exception:
+        errorMessage = traceback.format_exc()
+    return (target, time.time() - timeStarted, errorMessage)
+
+def runTargetsInPool(targets, nJobs, failedTargets):
+    # Runs targets on a new pool of nJobs workers until they are all done or a worker dies.
+    # Returns (targets that were running when the pool broke, targets not submitted yet); both are empty if no worker died.
+    targetsToSubmit = list(reversed(targets)) # popped from the end, so that targets are submitted in their original order
+    runningTargets = {}
+    isPoolBroken = False
+    # "fork" explicitly: this script does all of its setup at module level, which must not be re-run by spawned workers
+    workersPool = concurrent.futures.ProcessPoolExecutor(max_workers=nJobs, mp_context=multiprocessing.get_context("fork"), initializer=initializeWorker)
+    try:
+        while (not(isPoolBroken) and ((len(targetsToSubmit) > 0) or (len(runningTargets) > 0))):
+            # At most nJobs targets are submitted at a time, so that if a worker dies, only the targets that were actually running are lost
+            while ((len(targetsToSubmit) > 0) and (len(runningTargets) < nJobs)):
+                target = targetsToSubmit.pop()
+                runningTargets[workersPool.submit(saveComparisonsWithTiming, target)] = target
+            completedFutures, notYetCompletedFutures = concurrent.futures.wait(list(runningTargets.keys()), return_when=concurrent.futures.FIRST_COMPLETED)
+            for completedFuture in completedFutures:
+                try:
+                    target, wallTime, errorMessage = completedFuture.result()
+                except concurrent.futures.process.BrokenProcessPool:
+                    isPoolBroken = True
+                    continue
+                runningTargets.pop(completedFuture)
+                if (errorMessage is None):
+                    print("Finished target: {t} in {w:.1f} s".format(t=target, w=wallTime))
+                else:
+                    print("FAILED target: {t} after {w:.1f} s. Error: {e}".format(t=target, w=wallTime, e=errorMessage))
+                    failedTargets[target] = errorMessage
+    finally:
+        workersPool.shutdown(wait=True)
+    return (list(runningTargets.values()), list(reversed(targetsToSubmit)))
+
+def saveComparisonsInParallel(targets, nJobs):
+    failedTargets = {}
+    targetsToRunAlone = []
+    targetsToRun = list(targets)
+    while (len(targetsToRun) > 0):
+        # If a worker dies without raising (e.g. on a segfault in ROOT), the targets that were running cannot be told apart: each of them is run again on its own, later
+        lostTargets, targetsToRun = runTargetsInPool(targetsToRun, nJobs, failedTargets)
+        for lostTarget in lostTargets:
+            print("Worker process died while running target {t} or a concurrent one; will run it again on its own.".format(t=lostTarget))
+        targetsToRunAlone.extend(lostTargets)
+    for target in targetsToRunAlone:
+        lostTargets, targetsNotSubmitted = runTargetsInPool([target], 1, failedTargets)
+        if (len(lostTargets) > 0):
+            print("FAILED target: {t}. Error: worker process died".format(t=target))
+            failedTargets[target] = "worker process died"
+    return failedTargets
+
 inputFileObject = open(inputArguments.inputFilePath, 'r')
 inputPlots = json.load(inputFileObject)
 inputFileObject.close()
@@ -593,7 +650,20 @@ inputFileObject.close()
 outputDirectory = getFormattedInputData(inputPlots["outputDirectory"])
 if not(os.path.isdir(outputDirectory)): subprocess.check_call("mkdir -p {oD}".format(oD=outputDirectory), shell=True, executable="/bin/bash")
 
-for target in inputPlots["targets"]:
-    saveComparisons(target)
+# Input files and histograms are shared across targets; in --jobs mode, each worker gets its own (initially empty) copy of this cache
+histogramsCache = tmROOTUtils.ROOTFileCache(maxOpenFiles=inputArguments.maxOpenFiles, maxCachedHistograms=inputArguments.maxCachedHistograms)
+
+if (inputArguments.jobs < 1): sys.exit("ERROR: --jobs must be at least 1. Currently: {j}".format(j=inputArguments.jobs))
+if (inputArguments.jobs == 1):
+    for target in inputPlots["targets"]:
+        saveComparisons(target)
+else:
+    failedTargets = saveComparisonsInParallel(list(inputPlots["targets"]), inputArguments.jobs)
+    if (len(failedTargets) > 0):
+        print("{n}/{m} targets failed:".format(n=len(failedTargets), m=len(inputPlots["targets"])))
+        for target in failedTargets:
+            print("    {t}: {e}".format(t=target, e=failedTargets[target]))
+        sys.exit("ERROR: some targets failed.")
+histogramsCache.closeAll()
 
 print("Done!")
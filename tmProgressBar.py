@@ -1,18 +1,41 @@
 from __future__ import print_function, division
 
-import sys, math, time
+import sys, math, time, threading, queue, tmGeneralUtils
 
-WEIGHT_OVERALL = 0.5
-WEIGHT_INSTANTANEOUS = 1.0 - WEIGHT_OVERALL
+DEFAULT_MAX_REDRAWS_PER_SECOND = 10.
+DEFAULT_RATE_SMOOTHING_TIME_SECONDS = 10.
+DEFAULT_MULTIBAR_REDRAW_INTERVAL_SECONDS = 0.25
+AGGREGATE_BAR_NAME = "total"
 
 def toInt(floatValue):
     return int(math.floor(0.5+floatValue))
 
+def getHoursMinutesSeconds(timeInSeconds):
+    hoursFloat = math.floor(timeInSeconds/3600.)
+    minutesFloat = math.floor((timeInSeconds - 3600.*hoursFloat)/60.)
+    return (toInt(hoursFloat), toInt(minutesFloat), timeInSeconds - 3600.*hoursFloat - 60.*minutesFloat)
+
 class tmProgressBar:
-    def __init__(self, counterMaxValue=0, progressBarCharacter=">", allowNewlineInBuffer=True):
+    def __init__(self, counterMaxValue=0, progressBarCharacter=">", allowNewlineInBuffer=True, maxRedrawsPerSecond=DEFAULT_MAX_REDRAWS_PER_SECOND, rateSmoothingTimeSeconds=DEFAULT_RATE_SMOOTHING_TIME_SECONDS):
+        # Redraws are limited to maxRedrawsPerSecond, so updateBar and update can be called on every iteration of a loop; None disables the limit
+        # Rates are exponentially weighted averages in time: progress made t seconds ago has weight exp(-t/rateSmoothingTimeSeconds), however irregular the updates
         self.timeStarted = 0.
         self.timeAtLastCheck = 0.
         self.fractionCompletedAtLastCheck = 0.
+        self.counterAtLastCheck = 0
+        self.bytesCompletedAtLastCheck = 0
+        self.rateSmoothingTimeSeconds = rateSmoothingTimeSeconds
+        self.rates = None # smoothed (fraction, counter, bytes) completed per second
+        self.rateAccumulators = (0., 0., 0.)
+        self.rateWeightsSum = 0.
+        self.minTimeBetweenRedraws = 0.
+        if not(maxRedrawsPerSecond is None): self.minTimeBetweenRedraws = 1./maxRedrawsPerSecond
+        self.hasRedrawn = False
+        self.pendingUpdate = None # (fractionCompleted, counterCurrentValue, bytesCompleted) of the last update not yet drawn
+        self.counterCurrentValue = 0
+        self.bytesCompleted = None
+        self.metrics = {}
+        self.lock = threading.Lock() # update() can be called from several threads
         self.counterMaxValue = counterMaxValue
         self.progressBarCharacter = progressBarCharacter
         self.formatString = ""
@@ -26,45 +49,188 @@ class tmProgressBar:
         self.timeStarted = initial_time
         self.timeAtLastCheck = initial_time
         self.fractionCompletedAtLastCheck = 0.
+        self.counterAtLastCheck = 0
+        self.bytesCompletedAtLastCheck = 0
+        self.rates = None
+        self.rateAccumulators = (0., 0., 0.)
+        self.rateWeightsSum = 0.
+        self.hasRedrawn = False
+        self.pendingUpdate = None
+        self.counterCurrentValue = 0
+        self.bytesCompleted = None
+        self.metrics = {}
 
-    def updateBar(self, fractionCompleted, counterCurrentValue = 0):
-        fractionRemaining = 1 - fractionCompleted
-        percentCompleted = toInt(fractionCompleted*100.)
+    def update(self, counterIncrement=1, bytesIncrement=None):
+        # Thread-safe increment of the counter, and optionally of the number of bytes processed; needs counterMaxValue > 0
+        with self.lock:
+            self.counterCurrentValue += counterIncrement
+            if not(bytesIncrement is None): self.bytesCompleted = bytesIncrement + (0 if (self.bytesCompleted is None) else self.bytesCompleted)
+            self.updateBar(self.counterCurrentValue/self.counterMaxValue, self.counterCurrentValue, self.bytesCompleted)
+
+    def updateBar(self, fractionCompleted, counterCurrentValue = 0, bytesCompleted = None):
         currentTime = time.time()
+        # Always draw the first and the final states
+        if (self.hasRedrawn and (currentTime - self.timeAtLastCheck < self.minTimeBetweenRedraws) and (fractionCompleted < 1.)):
+            self.pendingUpdate = (fractionCompleted, counterCurrentValue, bytesCompleted)
+            return
+        self.redraw(fractionCompleted, counterCurrentValue, bytesCompleted, currentTime)
 
+    def updateMetrics(self, fractionCompleted, counterCurrentValue, bytesCompleted, currentTime):
         timeElapsedSinceStart = currentTime - self.timeStarted
-        completionRate_overall = fractionCompleted/timeElapsedSinceStart
-
         timeElapsedSinceLastCheck = currentTime - self.timeAtLastCheck
-        fractionCompletedSinceLastCheck = fractionCompleted - self.fractionCompletedAtLastCheck
-        completionRate_instantaneous = fractionCompletedSinceLastCheck/timeElapsedSinceLastCheck
+        if (timeElapsedSinceLastCheck > 0.):
+            bytesCompletedForRate = (self.bytesCompletedAtLastCheck if (bytesCompleted is None) else bytesCompleted)
+            rates_sinceLastCheck = ((fractionCompleted - self.fractionCompletedAtLastCheck)/timeElapsedSinceLastCheck,
+                                    (counterCurrentValue - self.counterAtLastCheck)/timeElapsedSinceLastCheck,
+                                    (bytesCompletedForRate - self.bytesCompletedAtLastCheck)/timeElapsedSinceLastCheck)
+            # Accumulated with the weights not normalized, then divided by their sum: early on, this is just the average since the start
+            weight_sinceLastCheck = 1. - math.exp(-timeElapsedSinceLastCheck/self.rateSmoothingTimeSeconds)
+            self.rateAccumulators = tuple(weight_sinceLastCheck*rate_sinceLastCheck + (1. - weight_sinceLastCheck)*rateAccumulator for rate_sinceLastCheck, rateAccumulator in zip(rates_sinceLastCheck, self.rateAccumulators))
+            self.rateWeightsSum = weight_sinceLastCheck + (1. - weight_sinceLastCheck)*self.rateWeightsSum
+            self.rates = tuple(rateAccumulator/self.rateWeightsSum for rateAccumulator in self.rateAccumulators)
+            self.counterAtLastCheck = counterCurrentValue
+            self.bytesCompletedAtLastCheck = bytesCompletedForRate
+            self.timeAtLastCheck = currentTime
+            self.fractionCompletedAtLastCheck = fractionCompleted
+        guess_timeRemaining = None
+        if (not(self.rates is None) and (self.rates[0] > 0.)): guess_timeRemaining = (1. - fractionCompleted)/self.rates[0]
+        self.metrics = {"timeElapsedSeconds": timeElapsedSinceStart,
+                        "fractionCompleted": fractionCompleted,
+                        "counterCurrentValue": counterCurrentValue,
+                        "itemsPerSecond": (0. if (self.rates is None) else self.rates[1]),
+                        "averageItemsPerSecond": ((counterCurrentValue/timeElapsedSinceStart) if (timeElapsedSinceStart > 0.) else 0.),
+                        "bytesCompleted": bytesCompleted,
+                        "bytesPerSecond": (None if ((bytesCompleted is None) or (self.rates is None)) else self.rates[2]),
+                        "estimatedTimeRemainingSeconds": guess_timeRemaining}
 
-        completionRate = WEIGHT_OVERALL*completionRate_overall + WEIGHT_INSTANTANEOUS*completionRate_instantaneous
+    def getMetrics(self):
+        # Values as of the last redraw
+        with self.lock:
+            return dict(self.metrics)
 
+    def redraw(self, fractionCompleted, counterCurrentValue, bytesCompleted, currentTime):
+        percentCompleted = toInt(fractionCompleted*100.)
+        self.updateMetrics(fractionCompleted, counterCurrentValue, bytesCompleted, currentTime)
         guess_timeRemaining = 0.
-        try:
-            guess_timeRemaining = fractionRemaining/completionRate
-        except ZeroDivisionError:
-            pass
-        guess_timeRemainingHoursFloat = math.floor(guess_timeRemaining/3600.)
-        guess_timeRemainingHours = toInt(guess_timeRemainingHoursFloat)
-        guess_timeRemainingMinutesFloat = math.floor((guess_timeRemaining - 3600.*guess_timeRemainingHoursFloat)/60.)
-        guess_timeRemainingMinutes = toInt(guess_timeRemainingMinutesFloat)
-        guess_timeRemainingSeconds = guess_timeRemaining - 3600.*guess_timeRemainingHoursFloat - 60.*guess_timeRemainingMinutesFloat
+        if not(self.metrics["estimatedTimeRemainingSeconds"] is None): guess_timeRemaining = self.metrics["estimatedTimeRemainingSeconds"]
+        guess_timeRemainingHours, guess_timeRemainingMinutes, guess_timeRemainingSeconds = getHoursMinutesSeconds(guess_timeRemaining)
         statusBuffer = ""
         if not(self.allowNewlineInBuffer): statusBuffer += '\r'
         statusBuffer += '    [' + (self.progressBarCharacter)*percentCompleted + '-'*(100-percentCompleted) + ("]   {pC:3d} % done. ETA: {hours:2d} h: {minutes:2d} m: {seconds:>04.1f} s.").format(pC=percentCompleted, hours=guess_timeRemainingHours, minutes=guess_timeRemainingMinutes, seconds=guess_timeRemainingSeconds)
-        if (self.counterMaxValue > 0): statusBuffer += (" Completed: {currentValue:" + self.formatString + "}/{maxValue:" + self.formatString + "}.").format(currentValue=counterCurrentValue, maxValue=self.counterMaxValue)
+        if (self.counterMaxValue > 0): statusBuffer += (" Completed: {currentValue:" + self.formatString + "}/{maxValue:" + self.formatString + "}. Rate: {r:.1f}/s.").format(currentValue=counterCurrentValue, maxValue=self.counterMaxValue, r=self.metrics["itemsPerSecond"])
+        if not(self.metrics["bytesPerSecond"] is None): statusBuffer += " {b}/s.".format(b=tmGeneralUtils.get_bytesize_human_readable(size_in_bytes_raw=max(0., self.metrics["bytesPerSecond"])))
         if (self.allowNewlineInBuffer): statusBuffer += '\n'
         sys.stdout.write(statusBuffer)
         sys.stdout.flush()
-        self.timeAtLastCheck = currentTime
-        self.fractionCompletedAtLastCheck = fractionCompleted
+        self.timeAtLastCheck = currentTime # also if updateMetrics was called less than a tick after the last check
+        self.hasRedrawn = True
+        self.pendingUpdate = None
 
     def terminate(self):
+        with self.lock:
+            if not(self.pendingUpdate is None): self.redraw(self.pendingUpdate[0], self.pendingUpdate[1], self.pendingUpdate[2], time.time()) # last state reached, which may not be 100%
         # self.updateBar(1., self.counterMaxValue) # Commented to catch potential bugs with loop exiting before expected end. Unfortunately, because this line is commented out, the output file doesn't always have "100% complete" at the end.
         print("")
 
+class tmMultiProgressBar:
+    '''Several named bars plus an aggregate one, redrawn in place by a single timer thread.
+
+    Updates are only put on a queue, so they are cheap and can come from any thread. For updates from other processes,
+    pass a multiprocessing queue as updatesQueue and have the processes put (barName, counterIncrement, bytesIncrement) tuples on it.
+    The display is refreshed every redrawIntervalSeconds, independently of the number of updates.'''
+    def __init__(self, counterMaxValues=None, barWidth=50, progressBarCharacter=">", redrawIntervalSeconds=DEFAULT_MULTIBAR_REDRAW_INTERVAL_SECONDS, rateSmoothingTimeSeconds=DEFAULT_RATE_SMOOTHING_TIME_SECONDS, updatesQueue=None):
+        # counterMaxValues: list of (bar name, maximum counter value), in display order
+        if ((counterMaxValues is None) or (len(counterMaxValues) == 0)): sys.exit("ERROR in tmMultiProgressBar: counterMaxValues must be a non-empty list of (bar name, maximum counter value).")
+        self.barNames = [barName for barName, counterMaxValue in counterMaxValues]
+        if (AGGREGATE_BAR_NAME in self.barNames): sys.exit("ERROR in tmMultiProgressBar: bar name \"{n}\" is reserved for the aggregate bar.".format(n=AGGREGATE_BAR_NAME))
+        self.counterMaxValues = dict(counterMaxValues)
+        self.counterMaxValues[AGGREGATE_BAR_NAME] = sum(counterMaxValue for barName, counterMaxValue in counterMaxValues)
+        self.counterValues = {barName: 0 for barName in self.counterMaxValues}
+        self.bytesCompleted = {barName: None for barName in self.counterMaxValues}
+        # tmProgressBar objects are only used for their rate estimates here
+        self.rateEstimators = {barName: tmProgressBar(counterMaxValue=self.counterMaxValues[barName], rateSmoothingTimeSeconds=rateSmoothingTimeSeconds) for barName in self.counterMaxValues}
+        self.barWidth = barWidth
+        self.progressBarCharacter = progressBarCharacter
+        self.redrawIntervalSeconds = redrawIntervalSeconds
+        self.updatesQueue = updatesQueue
+        if (self.updatesQueue is None): self.updatesQueue = queue.Queue()
+        self.nameWidth = max(len(barName) for barName in self.counterMaxValues)
+        self.counterWidth = len(str(self.counterMaxValues[AGGREGATE_BAR_NAME]))
+        self.redrawInPlace = sys.stdout.isatty() # otherwise, e.g. in log files, every redraw is appended
+        self.nLinesDrawn = 0
+        self.stopEvent = threading.Event()
+        self.timerThread = None
+
+    def update(self, barName, counterIncrement=1, bytesIncrement=None):
+        if not(barName in self.barNames): sys.exit("ERROR in tmMultiProgressBar: unknown bar name: {n}".format(n=barName))
+        self.updatesQueue.put((barName, counterIncrement, bytesIncrement))
+
+    def applyQueuedUpdates(self):
+        while True:
+            try:
+                queuedUpdate = self.updatesQueue.get_nowait()
+            except queue.Empty:
+                break
+            # This runs on the timer thread, where sys.exit would only stop the redraws: bad updates, e.g. put on updatesQueue directly by other processes, are skipped instead
+            try:
+                barName, counterIncrement, bytesIncrement = queuedUpdate
+            except (TypeError, ValueError):
+                print("WARNING in tmMultiProgressBar: skipping update that is not a (bar name, counter increment, bytes increment) tuple: {u}".format(u=queuedUpdate))
+                continue
+            if not(barName in self.barNames):
+                print("WARNING in tmMultiProgressBar: skipping update for unknown bar name: {n}".format(n=barName))
+                continue
+            for barNameToUpdate in [barName, AGGREGATE_BAR_NAME]:
+                self.counterValues[barNameToUpdate] += counterIncrement
+                if not(bytesIncrement is None): self.bytesCompleted[barNameToUpdate] = bytesIncrement + (0 if (self.bytesCompleted[barNameToUpdate] is None) else self.bytesCompleted[barNameToUpdate])
+
+    def getBarLine(self, barName, currentTime):
+        counterMaxValue = self.counterMaxValues[barName]
+        fractionCompleted = (1. if (counterMaxValue == 0) else min(1., self.counterValues[barName]/counterMaxValue))
+        rateEstimator = self.rateEstimators[barName]
+        if ((fractionCompleted < 1.) or (rateEstimator.fractionCompletedAtLastCheck < 1.) or (len(rateEstimator.metrics) == 0)): # rates of finished bars stay frozen
+            rateEstimator.updateMetrics(fractionCompleted, self.counterValues[barName], self.bytesCompleted[barName], currentTime)
+        nCharactersCompleted = toInt(fractionCompleted*self.barWidth)
+        barLine = ("{n:<" + str(self.nameWidth) + "} [").format(n=barName) + self.progressBarCharacter*nCharactersCompleted + '-'*(self.barWidth - nCharactersCompleted)
+        barLine += ("] {pC:3d} % {c:" + str(self.counterWidth) + "d}/{m:" + str(self.counterWidth) + "d} {r:8.1f}/s").format(pC=toInt(fractionCompleted*100.), c=self.counterValues[barName], m=counterMaxValue, r=rateEstimator.metrics["itemsPerSecond"])
+        if not(rateEstimator.metrics["bytesPerSecond"] is None): barLine += " {b:>11}/s".format(b=tmGeneralUtils.get_bytesize_human_readable(size_in_bytes_raw=max(0., rateEstimator.metrics["bytesPerSecond"])))
+        if (fractionCompleted < 1.):
+            timeRemaining = rateEstimator.metrics["estimatedTimeRemainingSeconds"]
+            if (timeRemaining is None): barLine += " ETA: unknown"
+            else: barLine += " ETA: {h:2d} h: {m:2d} m: {s:>04.1f} s".format(**dict(zip(["h", "m", "s"], getHoursMinutesSeconds(timeRemaining))))
+        return barLine
+
+    def redraw(self):
+        self.applyQueuedUpdates()
+        currentTime = time.time()
+        statusBuffer = ""
+        if (self.redrawInPlace and (self.nLinesDrawn > 0)): statusBuffer += "\x1b[{n}A".format(n=self.nLinesDrawn) # move back up to the first bar
+        barLines = [self.getBarLine(barName, currentTime) for barName in self.barNames] + [self.getBarLine(AGGREGATE_BAR_NAME, currentTime)]
+        for barLine in barLines:
+            statusBuffer += barLine
+            if self.redrawInPlace: statusBuffer += "\x1b[K" # clear the rest of the previous, possibly longer, line
+            statusBuffer += "\n"
+        sys.stdout.write(statusBuffer)
+        sys.stdout.flush()
+        self.nLinesDrawn = len(barLines)
+
+    def runTimer(self):
+        while not(self.stopEvent.wait(self.redrawIntervalSeconds)):
+            self.redraw()
+
+    def start(self):
+        for rateEstimator in self.rateEstimators.values(): rateEstimator.initializeTimer()
+        self.redraw()
+        self.timerThread = threading.Thread(target=self.runTimer)
+        self.timerThread.daemon = True
+        self.timerThread.start()
+
+    def terminate(self):
+        # Stops the timer and draws the final state
+        self.stopEvent.set()
+        if not(self.timerThread is None): self.timerThread.join()
+        self.redraw()
+
 def tmProgressBarTest():
     print("Beginning tests...")
     print("First with allowNewlineInBuffer = True:")
@@ -87,6 +253,36 @@ def tmProgressBarTest():
             time.sleep(0.1)
         progressBar.updateBar(testCounter/1000, testCounter)
     progressBar.terminate()
+    print("Next with one million calls to update, from four threads:")
+    progressBar = tmProgressBar(counterMaxValue=1000000, progressBarCharacter="+", allowNewlineInBuffer=False)
+    progressBar.initializeTimer()
+    def incrementCounter():
+        for testCounter in range(250000):
+            progressBar.update()
+    testThreads = [threading.Thread(target=incrementCounter) for threadIndex in range(4)]
+    for testThread in testThreads: testThread.start()
+    for testThread in testThreads: testThread.join()
+    progressBar.terminate()
+    print("Time taken: {t:.1f} s; final count: {c}".format(t=time.time()-progressBar.timeStarted, c=progressBar.counterCurrentValue))
+    print("Next with byte counts:")
+    progressBar = tmProgressBar(counterMaxValue=100, progressBarCharacter="+", allowNewlineInBuffer=False)
+    progressBar.initializeTimer()
+    for testCounter in range(1, 101):
+        time.sleep(0.02)
+        progressBar.update(bytesIncrement=1000000)
+    progressBar.terminate()
+    print("Metrics: {m}".format(m=progressBar.getMetrics()))
+    print("Next with four bars updated from four threads:")
+    multiProgressBar = tmMultiProgressBar(counterMaxValues=[("worker{i}".format(i=workerIndex), 50*(1+workerIndex)) for workerIndex in range(4)], progressBarCharacter="+")
+    multiProgressBar.start()
+    def runWorker(workerIndex):
+        for testCounter in range(50*(1+workerIndex)):
+            time.sleep(0.01*(1+workerIndex))
+            multiProgressBar.update("worker{i}".format(i=workerIndex), bytesIncrement=1000)
+    testThreads = [threading.Thread(target=runWorker, args=(workerIndex,)) for workerIndex in range(4)]
+    for testThread in testThreads: testThread.start()
+    for testThread in testThreads: testThread.join()
+    multiProgressBar.terminate()
     print("Finished tests.")
 
 if __name__ == "__main__":
@@ -2,10 +2,16 @@ from __future__ import print_function, division
 
 import ROOT
 
-import os, sys, math, array
+import os, sys, math, array, collections
+import numpy
 
 ONE_SIGMA_GAUSS = 0.682689492
 ZERO_TOLERANCE = 0.000001
+DEFAULT_MAX_OPEN_FILES = 20
+DEFAULT_MAX_CACHED_HISTOGRAMS = 200
+POISSON_INTERVALS_CACHE_MAX_COUNT = 1000 # intervals for integer counts below this are computed once per confidence level
+# Histogram classes store their bin contents in one of these arrays, which can be read out in a single call
+TARRAY_NUMPY_TYPES = [(ROOT.TArrayD, numpy.float64), (ROOT.TArrayF, numpy.float32), (ROOT.TArrayI, numpy.int32), (ROOT.TArrayS, numpy.int16), (ROOT.TArrayC, numpy.int8)]
 
 def addInputFilesToTree(inputTree, listOfFilesToAdd):
     print ("Adding input files to tree...")
@@ -33,24 +39,72 @@ def setYRangesToListMax(listOfInputHistograms):
     for inputHistogram in listOfInputHistograms:
         inputHistogram.GetYaxis().SetRangeUser(0., 1.1*maximumValue)
 
+def isTH1Profile(inputTH1):
+    # TProfile2D and TProfile3D do not inherit from TProfile
+    return any((inputTH1.InheritsFrom(profileClassName) == ROOT.kTRUE) for profileClassName in ["TProfile", "TProfile2D", "TProfile3D"])
+
+def getTH1ContentsArray(inputTH1):
+    '''Returns the contents of all cells of inputTH1, including under- and overflow, as a float64 array indexed by global bin number.'''
+    nCells = inputTH1.GetNcells()
+    if isTH1Profile(inputTH1): # the array of a profile holds the sums of w*y, not the bin means
+        return numpy.array([inputTH1.GetBinContent(globalBinIndex) for globalBinIndex in range(nCells)], dtype=numpy.float64)
+    for TArrayType, numpyType in TARRAY_NUMPY_TYPES:
+        if isinstance(inputTH1, TArrayType):
+            return numpy.frombuffer(inputTH1.GetArray(), dtype=numpyType, count=nCells).astype(numpy.float64)
+    return numpy.array([inputTH1.GetBinContent(globalBinIndex) for globalBinIndex in range(nCells)], dtype=numpy.float64)
+
+def getTH1ErrorsArray(inputTH1):
+    '''Returns the errors on all cells of inputTH1, including under- and overflow, as a float64 array indexed by global bin number.'''
+    nCells = inputTH1.GetNcells()
+    if (not(inputTH1.GetBinErrorOption() == ROOT.TH1.kNormal) or isTH1Profile(inputTH1)): # errors not derived from sumw2 alone
+        return numpy.array([inputTH1.GetBinError(globalBinIndex) for globalBinIndex in range(nCells)], dtype=numpy.float64)
+    if (inputTH1.GetSumw2N() > 0):
+        return numpy.sqrt(numpy.frombuffer(inputTH1.GetSumw2().GetArray(), dtype=numpy.float64, count=nCells))
+    return numpy.sqrt(numpy.abs(getTH1ContentsArray(inputTH1)))
+
+def getAxisBinEdgesArray(inputAxis):
+    nBins = inputAxis.GetNbins()
+    if (inputAxis.IsVariableBinSize()):
+        return numpy.frombuffer(inputAxis.GetXbins().GetArray(), dtype=numpy.float64, count=1+nBins).copy()
+    return numpy.linspace(inputAxis.GetXmin(), inputAxis.GetXmax(), 1+nBins)
+
+def getAxisBinCentersArray(inputAxis):
+    nBins = inputAxis.GetNbins()
+    if (inputAxis.IsVariableBinSize()):
+        binEdges = getAxisBinEdgesArray(inputAxis)
+        return 0.5*(binEdges[:-1] + binEdges[1:])
+    return inputAxis.GetXmin() + (numpy.arange(1, 1+nBins) - 0.5)*((inputAxis.GetXmax() - inputAxis.GetXmin())/nBins) # same arithmetic as TAxis::GetBinCenter
+
+def getTH1InnerCellsMask(inputTH1):
+    '''Returns a boolean array indexed by global bin number that is False for under- and overflow cells and True otherwise.'''
+    axes = [inputTH1.GetXaxis(), inputTH1.GetYaxis(), inputTH1.GetZaxis()][:inputTH1.GetDimension()]
+    innerCellsMask = numpy.zeros([2+axis.GetNbins() for axis in reversed(axes)], dtype=bool) # global bin = x + (nx+2)*(y + (ny+2)*z), i.e. x varies fastest
+    innerCellsMask[tuple([slice(1, -1)]*len(axes))] = True
+    return innerCellsMask.ravel()
+
+def setTH1ContentsAndErrorsFromArrays(outputTH1, contentsArray, errorsArray):
+    '''Overwrites the contents and errors of all cells of outputTH1, including under- and overflow, from arrays indexed by global bin number.'''
+    if isTH1Profile(outputTH1): sys.exit("ERROR in setTH1ContentsAndErrorsFromArrays: cannot set the contents of profiles, which are derived from sums of weights; histogram name: {n}".format(n=outputTH1.GetName()))
+    nCells = outputTH1.GetNcells()
+    if not((len(contentsArray) == nCells) and (len(errorsArray) == nCells)): sys.exit("ERROR in setTH1ContentsAndErrorsFromArrays: histogram has {n} cells, but len(contentsArray) = {c}, len(errorsArray) = {e}".format(n=nCells, c=len(contentsArray), e=len(errorsArray)))
+    outputTH1.SetContent(numpy.ascontiguousarray(contentsArray, dtype=numpy.float64))
+    outputTH1.SetError(numpy.ascontiguousarray(errorsArray, dtype=numpy.float64))
+
 def getRatioGraph(numeratorHistogram, denominatorHistogram):
     graphXAxis = numeratorHistogram.GetXaxis()
     nXBins = graphXAxis.GetNbins()
-    ratioGraph = ROOT.TGraphErrors(nXBins)
-    for binNumber in range(1, 1+nXBins):
-        xValue = graphXAxis.GetBinCenter(binNumber)
-        xBinWidth = graphXAxis.GetBinWidth(binNumber)
-        numeratorValue = numeratorHistogram.GetBinContent(binNumber)
-        denominatorValue = denominatorHistogram.GetBinContent(binNumber)
-        ratioValue = 1.
-        ratioError = 1.
-        if (denominatorValue > 0.):
-            ratioValue = numeratorValue/denominatorValue
-            numeratorError = numeratorHistogram.GetBinError(binNumber)
-            denominatorError = denominatorHistogram.GetBinError(binNumber)
-            ratioError = (1.0/denominatorValue)*math.sqrt(math.pow(numeratorError,2) + math.pow(denominatorError*ratioValue,2))
-        ratioGraph.SetPoint(binNumber-1, xValue, ratioValue)
-        ratioGraph.SetPointError(binNumber-1, xBinWidth, ratioError)
+    xValues = getAxisBinCentersArray(graphXAxis)
+    xBinWidths = numpy.diff(getAxisBinEdgesArray(graphXAxis))
+    numeratorValues = getTH1ContentsArray(numeratorHistogram)[1:1+nXBins]
+    numeratorErrors = getTH1ErrorsArray(numeratorHistogram)[1:1+nXBins]
+    denominatorValues = getTH1ContentsArray(denominatorHistogram)[1:1+nXBins]
+    denominatorErrors = getTH1ErrorsArray(denominatorHistogram)[1:1+nXBins]
+    ratioValues = numpy.ones(nXBins)
+    ratioErrors = numpy.ones(nXBins)
+    hasPositiveDenominator = (denominatorValues > 0.)
+    ratioValues[hasPositiveDenominator] = numeratorValues[hasPositiveDenominator]/denominatorValues[hasPositiveDenominator]
+    ratioErrors[hasPositiveDenominator] = (1.0/denominatorValues[hasPositiveDenominator])*numpy.sqrt(numpy.square(numeratorErrors[hasPositiveDenominator]) + numpy.square(denominatorErrors[hasPositiveDenominator]*ratioValues[hasPositiveDenominator]))
+    ratioGraph = ROOT.TGraphErrors(nXBins, xValues, ratioValues, xBinWidths, ratioErrors)
     return ratioGraph
 
 def checkTH1Alignment(histogram1=None, histogram2=None):
@@ -65,20 +119,24 @@ def checkTH1Alignment(histogram1=None, histogram2=None):
         print("histogram1 and histogram2 must belong to the same class; currently, ClassName of histogram1 = {n}, histogram2 = {d}".format(n=histogram1.ClassName(), d=histogram2.ClassName()))
         return False
     if (not(histogram1.GetXaxis().GetNbins() == histogram2.GetXaxis().GetNbins())):
-        print("number of bins in X in histogram1 = {n1} does not match histogram2 = {n2}".format(n1 = histogram1.GetXaxis().GetNbins(), n2 = denominatorHistogram.GetXaxis().GetNbins()))
+        print("number of bins in X in histogram1 = {n1} does not match histogram2 = {n2}".format(n1 = histogram1.GetXaxis().GetNbins(), n2 = histogram2.GetXaxis().GetNbins()))
+        return False
+    xBinCenters1 = getAxisBinCentersArray(histogram1.GetXaxis())
+    xBinCenters2 = getAxisBinCentersArray(histogram2.GetXaxis())
+    misalignedXBins = numpy.flatnonzero(~(numpy.abs(xBinCenters1 - xBinCenters2) < ZERO_TOLERANCE*numpy.maximum(1., numpy.abs(xBinCenters1))))
+    if (len(misalignedXBins) > 0):
+        print("x bin centers do not align at x index = {i}. centers: histogram1 = {x1}, histogram2 = {x2}".format(i = 1+misalignedXBins[0], x1 = xBinCenters1[misalignedXBins[0]], x2 = xBinCenters2[misalignedXBins[0]]))
         return False
-    for xBinIndex in range(1, 1+histogram1.GetXaxis().GetNbins()):
-        if (not(abs(histogram1.GetXaxis().GetBinCenter(xBinIndex) - histogram2.GetXaxis().GetBinCenter(xBinIndex)) < ZERO_TOLERANCE*max(1., abs(histogram1.GetXaxis().GetBinCenter(xBinIndex))))):
-            print("x bin centers do not align at x index = {i}. centers: histogram1 = {x1}, histogram2 = {x2}".format(x1 = histogram1.GetXaxis().GetBinCenter(xBinIndex), x2 = histogram2.GetXaxis().GetBinCenter(xBinIndex)))
-            return False
     if (histogram1.InheritsFrom("TH2") == ROOT.kTRUE):
         if (not(histogram1.GetYaxis().GetNbins() == histogram2.GetYaxis().GetNbins())):
-            print("number of bins in Y in histogram1 = {n1} does not match histogram2 = {n2}".format(n1 = histogram1.GetYaxis().GetNbins(), n2 = denominatorHistogram.GetYaxis().GetNbins()))
+            print("number of bins in Y in histogram1 = {n1} does not match histogram2 = {n2}".format(n1 = histogram1.GetYaxis().GetNbins(), n2 = histogram2.GetYaxis().GetNbins()))
+            return False
+        yBinCenters1 = getAxisBinCentersArray(histogram1.GetYaxis())
+        yBinCenters2 = getAxisBinCentersArray(histogram2.GetYaxis())
+        misalignedYBins = numpy.flatnonzero(~(numpy.abs(yBinCenters1 - yBinCenters2) < ZERO_TOLERANCE*numpy.maximum(1., numpy.abs(yBinCenters1))))
+        if (len(misalignedYBins) > 0):
+            print("y bin centers do not align at y index = {i}. centers: histogram1 = {y1}, histogram2 = {y2}".format(i = 1+misalignedYBins[0], y1 = yBinCenters1[misalignedYBins[0]], y2 = yBinCenters2[misalignedYBins[0]]))
             return False
-        for yBinIndex in range(1, 1+histogram1.GetYaxis().GetNbins()):
-            if (not(abs(histogram1.GetYaxis().GetBinCenter(yBinIndex) - histogram2.GetYaxis().GetBinCenter(yBinIndex)) < ZERO_TOLERANCE*max(1., abs(histogram1.GetYaxis().GetBinCenter(yBinIndex))))):
-                print("y bin centers do not align at y index = {i}. centers: histogram1 = {y1}, histogram2 = {y2}".format(y1 = histogram1.GetYaxis().GetBinCenter(yBinIndex), y2 = histogram2.GetYaxis().GetBinCenter(yBinIndex)))
-                return False
     return True
 
 def getRatioHistogram(numeratorHistogram=None, denominatorHistogram=None, valueAtZeroDenominator = 0., name="ratio", title=""):
@@ -86,36 +144,19 @@ def getRatioHistogram(numeratorHistogram=None, denominatorHistogram=None, valueA
     outputHistogram = numeratorHistogram.Clone("new")
     outputHistogram.SetName(name)
     outputHistogram.SetTitle(title)
-    if (numeratorHistogram.InheritsFrom("TH2") == ROOT.kTRUE):
-        for xBinIndex in range(1, 1+outputHistogram.GetXaxis().GetNbins()):
-            xCenter = outputHistogram.GetXaxis().GetBinCenter(xBinIndex)
-            for yBinIndex in range(1, 1+outputHistogram.GetYaxis().GetNbins()):
-                yCenter = outputHistogram.GetYaxis().GetBinCenter(yBinIndex)
-                numerator = numeratorHistogram.GetBinContent(numeratorHistogram.FindFixBin(xCenter, yCenter))
-                numeratorError = numeratorHistogram.GetBinError(numeratorHistogram.FindFixBin(xCenter, yCenter))
-                denominator = denominatorHistogram.GetBinContent(denominatorHistogram.FindFixBin(xCenter, yCenter))
-                denominatorError = denominatorHistogram.GetBinError(denominatorHistogram.FindFixBin(xCenter, yCenter))
-                ratio = valueAtZeroDenominator
-                ratioError = 0.
-                if (denominator > 0.):
-                    ratio = numerator/denominator
-                    if (numerator > 0.): ratioError = ratio*math.sqrt(math.pow(numeratorError/numerator, 2) + math.pow(denominatorError/denominator, 2))
-                outputHistogram.SetBinContent(outputHistogram.FindFixBin(xCenter, yCenter), ratio)
-                outputHistogram.SetBinError(outputHistogram.FindFixBin(xCenter, yCenter), ratioError)
-    else:
-        for xBinIndex in range(1, 1+outputHistogram.GetXaxis().GetNbins()):
-            xCenter = outputHistogram.GetXaxis().GetBinCenter(xBinIndex)
-            numerator = numeratorHistogram.GetBinContent(numeratorHistogram.FindFixBin(xCenter))
-            numeratorError = numeratorHistogram.GetBinError(numeratorHistogram.FindFixBin(xCenter))
-            denominator = denominatorHistogram.GetBinContent(denominatorHistogram.FindFixBin(xCenter))
-            denominatorError = denominatorHistogram.GetBinError(denominatorHistogram.FindFixBin(xCenter))
-            ratio = valueAtZeroDenominator
-            ratioError = 0.
-            if (denominator > 0.):
-                ratio = numerator/denominator
-                if (numerator > 0.): ratioError = ratio*math.sqrt(math.pow(numeratorError/numerator, 2) + math.pow(denominatorError/denominator, 2))
-            outputHistogram.SetBinContent(outputHistogram.FindFixBin(xCenter), ratio)
-            outputHistogram.SetBinError(outputHistogram.FindFixBin(xCenter), ratioError)
+    # Since the histograms align, corresponding bins have the same global bin number; under- and overflow are left as in the numerator
+    numerators = getTH1ContentsArray(numeratorHistogram)
+    numeratorErrors = getTH1ErrorsArray(numeratorHistogram)
+    denominators = getTH1ContentsArray(denominatorHistogram)
+    denominatorErrors = getTH1ErrorsArray(denominatorHistogram)
+    ratios = numpy.full(len(numerators), float(valueAtZeroDenominator))
+    ratioErrors = numpy.zeros(len(numerators))
+    hasPositiveDenominator = (denominators > 0.)
+    ratios[hasPositiveDenominator] = numerators[hasPositiveDenominator]/denominators[hasPositiveDenominator]
+    hasPositiveNumeratorAndDenominator = (hasPositiveDenominator & (numerators > 0.))
+    ratioErrors[hasPositiveNumeratorAndDenominator] = ratios[hasPositiveNumeratorAndDenominator]*numpy.sqrt(numpy.square(numeratorErrors[hasPositiveNumeratorAndDenominator]/numerators[hasPositiveNumeratorAndDenominator]) + numpy.square(denominatorErrors[hasPositiveNumeratorAndDenominator]/denominators[hasPositiveNumeratorAndDenominator]))
+    innerCellsMask = getTH1InnerCellsMask(outputHistogram)
+    setTH1ContentsAndErrorsFromArrays(outputHistogram, numpy.where(innerCellsMask, ratios, numerators), numpy.where(innerCellsMask, ratioErrors, numeratorErrors))
     return outputHistogram
 
 def getGraphOfRatioOfAsymmErrorsGraphToHistogram(numeratorGraph=None, denominatorHistogram=None, outputName="g", outputTitle="", printDebug=False):
@@ -167,12 +208,11 @@ def normalizeHistogam(inputHist):
 
 def getSumOfBinContents(inputTH1, includeUnderflow=False, includeOverflow=False):
     nBins = inputTH1.GetXaxis().GetNbins()
-    sumBinContents = 0
-    for binCounter in range(0, 2+nBins):
-        includeBin = True
-        if (binCounter == 0): includeBin = includeUnderflow
-        elif (binCounter == (1+nBins)): includeBin = includeOverflow
-        if includeBin: sumBinContents += inputTH1.GetBinContent(binCounter)
+    firstBin = 1
+    if includeUnderflow: firstBin = 0
+    lastBin = nBins
+    if includeOverflow: lastBin = 1+nBins
+    sumBinContents = float(numpy.sum(getTH1ContentsArray(inputTH1)[firstBin:1+lastBin]))
     return sumBinContents
 
 def extractTH2Contents(inputTH2, outputFileName, columnTitles=None, quantityName=None, includeOverflow=False, formatSpecifiers=None, onlyOutputNonzero=True, printRangeX=False, printRangeY=False):
@@ -288,6 +328,54 @@ def getPoissonConfidenceInterval(confidenceLevel = ONE_SIGMA_GAUSS, observedNEve
     outputDict = {"lower": lowerLimit, "upper": upperLimit}
     return outputDict
 
+poissonConfidenceIntervalsCache = {} # confidence level -> (lower limits, upper limits) for the counts 0, 1, ..., POISSON_INTERVALS_CACHE_MAX_COUNT-1
+
+def computePoissonConfidenceIntervalsArrays(confidenceLevel, observedNEventsArray):
+    import scipy.stats # only needed here
+    alpha = 1. - confidenceLevel
+    lowerLimits = numpy.zeros(len(observedNEventsArray))
+    hasPositiveCount = (observedNEventsArray > 0)
+    lowerLimits[hasPositiveCount] = scipy.stats.gamma.ppf((alpha/2.), observedNEventsArray[hasPositiveCount])
+    upperLimits = scipy.stats.gamma.isf((alpha/2.), 1+observedNEventsArray)
+    return (lowerLimits, upperLimits)
+
+def getPoissonConfidenceIntervalsArrays(confidenceLevel = ONE_SIGMA_GAUSS, observedNEventsArray = None):
+    '''Array version of getPoissonConfidenceInterval: returns the arrays (lower limits, upper limits) for an array of observed counts, which need not be integers.'''
+    if (observedNEventsArray is None): sys.exit("ERROR in getPoissonConfidenceIntervalsArrays: observedNEventsArray is not passed or is None.")
+    observedNEventsArray = numpy.asarray(observedNEventsArray, dtype=numpy.float64).ravel()
+    if numpy.any(observedNEventsArray < 0.): sys.exit("ERROR in getPoissonConfidenceIntervalsArrays: negative counts found: {c}".format(c=observedNEventsArray[observedNEventsArray < 0.]))
+    if not(confidenceLevel in poissonConfidenceIntervalsCache):
+        poissonConfidenceIntervalsCache[confidenceLevel] = computePoissonConfidenceIntervalsArrays(confidenceLevel, numpy.arange(POISSON_INTERVALS_CACHE_MAX_COUNT, dtype=numpy.float64))
+    cachedLowerLimits, cachedUpperLimits = poissonConfidenceIntervalsCache[confidenceLevel]
+    lowerLimits = numpy.zeros(len(observedNEventsArray))
+    upperLimits = numpy.zeros(len(observedNEventsArray))
+    isCached = ((observedNEventsArray < POISSON_INTERVALS_CACHE_MAX_COUNT) & (observedNEventsArray == numpy.floor(observedNEventsArray)))
+    cachedCounts = observedNEventsArray[isCached].astype(numpy.int64)
+    lowerLimits[isCached] = cachedLowerLimits[cachedCounts]
+    upperLimits[isCached] = cachedUpperLimits[cachedCounts]
+    if not(numpy.all(isCached)):
+        lowerLimits[~isCached], upperLimits[~isCached] = computePoissonConfidenceIntervalsArrays(confidenceLevel, observedNEventsArray[~isCached])
+    return (lowerLimits, upperLimits)
+
+def getPoissonErrorsGraph(input1DHistogram = None, confidenceLevel = ONE_SIGMA_GAUSS, outputName = "g", outputTitle = ""):
+    '''Returns a TGraphAsymmErrors with one point per bin of input1DHistogram, at the bin center with x errors spanning the bin, and with Poisson confidence intervals as y errors.'''
+    if (input1DHistogram is None): sys.exit("option input1DHistogram is not passed or is None.")
+    if (input1DHistogram.InheritsFrom("TH1")):
+        if (input1DHistogram.InheritsFrom("TH2") or input1DHistogram.InheritsFrom("TH3")):
+            sys.exit("Unable to build Poisson errors graph from 2D or 3D histograms.")
+    else:
+        sys.exit("Input histogram does not inherit from TH1. Class: {c}".format(c=input1DHistogram.ClassName()))
+    inputXAxis = input1DHistogram.GetXaxis()
+    nXBins = inputXAxis.GetNbins()
+    xValues = getAxisBinCentersArray(inputXAxis)
+    xHalfBinWidths = 0.5*numpy.diff(getAxisBinEdgesArray(inputXAxis))
+    yValues = getTH1ContentsArray(input1DHistogram)[1:1+nXBins]
+    lowerLimits, upperLimits = getPoissonConfidenceIntervalsArrays(confidenceLevel=confidenceLevel, observedNEventsArray=yValues)
+    outputGraph = ROOT.TGraphAsymmErrors(nXBins, xValues, yValues, xHalfBinWidths, xHalfBinWidths, yValues - lowerLimits, upperLimits - yValues)
+    outputGraph.SetName(outputName)
+    outputGraph.SetTitle(outputTitle)
+    return outputGraph
+
 def rescale1DHistogramByBinWidth(input1DHistogram = None):
     if (input1DHistogram is None): sys.exit("option input1DHistogram is not passed or is None.")
     if (input1DHistogram.InheritsFrom("TH1")):
@@ -301,20 +389,20 @@ def rescale1DHistogramByBinWidth(input1DHistogram = None):
     if(inputClone.GetBinErrorOption() == ROOT.TH1.kPoisson):
         print("WARNING: trying to rescale histogram with name {n} with Poisson errors: unsure if error bars will work correctly, trying anyway...".format(n=inputClone.GetName()))
     inputXAxis = inputClone.GetXaxis()
-    for binCounter in range(0, 2+inputXAxis.GetNbins()):
-        binCenter = inputXAxis.GetBinCenter(binCounter)
-        binContent = inputClone.GetBinContent(binCounter)
-        binError = inputClone.GetBinError(binCounter)
-        binWidth = inputXAxis.GetBinWidth(binCounter)
-        if(inputClone.GetBinErrorOption() == ROOT.TH1.kPoisson):
+    if(inputClone.GetBinErrorOption() == ROOT.TH1.kPoisson):
+        for binCounter in range(0, 2+inputXAxis.GetNbins()):
+            binCenter = inputXAxis.GetBinCenter(binCounter)
+            binContent = inputClone.GetBinContent(binCounter)
+            binWidth = inputXAxis.GetBinWidth(binCounter)
             if (abs(int(0.5+binContent)-binContent) <= ZERO_TOLERANCE*binContent): # Because "getBinContent", even on ROOT's TH1I, apparently returns a float
                 for uglyHackCounter in range(0, int(0.5+binContent)):
                     input1DHistogram.Fill(binCenter, 1.0/binWidth)
             else:
                 sys.exit("input histogram has Poisson errors but a non-integer number of events {n} in bin {i}. Don't know how to rescale...".format(n=binContent, i=binCounter))
-        else:
-            input1DHistogram.SetBinContent(binCounter, binContent/binWidth)
-            input1DHistogram.SetBinError(binCounter, binError/binWidth)
+    else:
+        binWidths = numpy.diff(getAxisBinEdgesArray(inputXAxis))
+        binWidths = numpy.concatenate(([binWidths[0]], binWidths, [binWidths[-1]])) # TAxis::GetBinWidth returns the width of the first (last) bin for the underflow (overflow) bin
+        setTH1ContentsAndErrorsFromArrays(input1DHistogram, getTH1ContentsArray(inputClone)/binWidths, getTH1ErrorsArray(inputClone)/binWidths)
 
 def printHistogramContents(inputHistogram = None):
     if (inputHistogram is None): sys.exit("option inputHistogram is not passed or is None.")
@@ -420,9 +508,54 @@ def getHistogramCorrectedBySlope(inputHistogram, slope, normX):
     outputHistogram = inputHistogram.Clone()
     normBinIndex = inputHistogram.GetXaxis().FindFixBin(normX)
     if ((normBinIndex == 0) or (normBinIndex > inputHistogram.GetXaxis().GetNbins())): sys.exit("ERROR: normX = {n} corresponds to normBinIndex = {nBI} which is outside the histogram range!".format(n=normX, nBI=normBinIndex))
-    for binIndex in range(1, 1 + inputHistogram.GetXaxis().GetNbins()):
-        binCenter = inputHistogram.GetXaxis().GetBinCenter(binIndex)
-        adjustment = 1.0 + slope*(binCenter - normX)
-        outputHistogram.SetBinContent(binIndex, (inputHistogram.GetBinContent(binIndex))/adjustment)
-        outputHistogram.SetBinError(binIndex, (inputHistogram.GetBinError(binIndex))/adjustment)
+    adjustments = numpy.ones(outputHistogram.GetNcells()) # under- and overflow are not adjusted
+    adjustments[1:1+inputHistogram.GetXaxis().GetNbins()] = 1.0 + slope*(getAxisBinCentersArray(inputHistogram.GetXaxis()) - normX)
+    setTH1ContentsAndErrorsFromArrays(outputHistogram, getTH1ContentsArray(inputHistogram)/adjustments, getTH1ErrorsArray(inputHistogram)/adjustments)
     return outputHistogram
+
+class ROOTFileCache:
+    '''LRU cache of open TFile handles, plus an LRU cache of histograms read from them keyed by (file path, histogram name). Histograms are handed out as clones by default, so callers are free to scale or add to them.'''
+    def __init__(self, maxOpenFiles=DEFAULT_MAX_OPEN_FILES, maxCachedHistograms=DEFAULT_MAX_CACHED_HISTOGRAMS):
+        if (maxOpenFiles < 1): sys.exit("ERROR in ROOTFileCache: maxOpenFiles must be at least 1. Currently: {m}".format(m=maxOpenFiles))
+        if (maxCachedHistograms < 0): sys.exit("ERROR in ROOTFileCache: maxCachedHistograms cannot be negative. Currently: {m}".format(m=maxCachedHistograms))
+        self.maxOpenFiles = maxOpenFiles
+        self.maxCachedHistograms = maxCachedHistograms
+        self.openFiles = collections.OrderedDict()
+        self.cachedHistograms = collections.OrderedDict()
+
+    def getFile(self, filePath):
+        if (filePath in self.openFiles):
+            inputFile = self.openFiles.pop(filePath) # re-inserted below, to mark as most recently used
+        else:
+            while (len(self.openFiles) >= self.maxOpenFiles):
+                leastRecentlyUsedFilePath, leastRecentlyUsedFile = self.openFiles.popitem(last=False)
+                leastRecentlyUsedFile.Close()
+            inputFile = ROOT.TFile.Open(filePath, "READ")
+            if ((not(inputFile)) or (inputFile.IsZombie() == ROOT.kTRUE) or not(inputFile.IsOpen() == ROOT.kTRUE)):
+                sys.exit("ERROR in opening file: {f}".format(f=filePath))
+        self.openFiles[filePath] = inputFile
+        return inputFile
+
+    def getHistogram(self, filePath, histogramName, returnClone=True):
+        # If returnClone is False, the cached object itself is returned; it should then only be used read-only, e.g. as the argument of TH1::Add
+        cacheKey = (filePath, histogramName)
+        if (cacheKey in self.cachedHistograms):
+            cachedHistogram = self.cachedHistograms.pop(cacheKey) # re-inserted below, to mark as most recently used
+        else:
+            histogramInFile = self.getFile(filePath).Get(histogramName)
+            if (not(histogramInFile) or not(histogramInFile.InheritsFrom("TH1") == ROOT.kTRUE)): sys.exit("Unable to find non-null histogram with name {n} in file {f}".format(n=histogramName, f=filePath))
+            cachedHistogram = histogramInFile.Clone()
+            cachedHistogram.SetDirectory(0) # so that the histogram survives when its file is closed
+        self.cachedHistograms[cacheKey] = cachedHistogram
+        while (len(self.cachedHistograms) > self.maxCachedHistograms):
+            self.cachedHistograms.popitem(last=False)
+        if not(returnClone): return cachedHistogram
+        outputHistogram = cachedHistogram.Clone()
+        outputHistogram.SetDirectory(0)
+        return outputHistogram
+
+    def closeAll(self):
+        for filePath in self.openFiles:
+            self.openFiles[filePath].Close()
+        self.openFiles.clear()
+        self.cachedHistograms.clear()
@@ -1,12 +1,132 @@
 from __future__ import print_function, division
 
-import os, sys, math
+import os, sys, math, time, concurrent.futures
 
+import numpy
 import scipy.stats
 
 DEFAULT_ZERO_TOLERANCE_COEFFICIENT=0.001
+DEFAULT_X_TOLERANCE_COEFFICIENT=1.e-9
+DEFAULT_MAX_ITERATIONS=200
+DEFAULT_X_QUANTUM_COEFFICIENT=1.e-12
+SCAN_MODES=["scalar", "vectorized", "processPool"]
+DEFAULT_N_SCAN_INTERVALS=100
+DEFAULT_INITIAL_SCAN_STEP_INTERVALS=4
 
-def getMonotonicFunctionApproximateZero(inputFunction=None, xRange=None, zeroTolerance=None, autoZeroTolerance=False, printDebug=False):
+class tmFunctionEvaluator:
+    '''Wraps a function of one variable, remembering its values so that no point is evaluated twice, and counting calls and time spent.
+
+    Points are identified after rounding x to a multiple of xQuantum (if given), so that the same point reached through different
+    floating-point arithmetic is still found in the cache. The optimizers below wrap their inputFunction in one of these unless it already is one;
+    pass your own to share the cache between several calls and to read the statistics afterwards.'''
+    def __init__(self, inputFunction=None, xQuantum=None):
+        if (inputFunction is None): raise TypeError("Error in tmStatsUtils.tmFunctionEvaluator(): named argument inputFunction is None")
+        if not(callable(inputFunction)): raise TypeError("Error in tmStatsUtils.tmFunctionEvaluator(): object passed as named argument inputFunction is not callable")
+        self.inputFunction = inputFunction
+        self.xQuantum = xQuantum
+        self.cachedValues = {}
+        self.nCalls = 0
+        self.nEvaluations = 0
+        self.evaluationTimeSeconds = 0.
+
+    def getKey(self, x):
+        if (self.xQuantum is None): return x
+        return int(round(x/self.xQuantum))
+
+    def __call__(self, x):
+        self.nCalls += 1
+        key = self.getKey(x)
+        if (key in self.cachedValues): return self.cachedValues[key]
+        timeStarted = time.time()
+        value = self.inputFunction(x)
+        self.evaluationTimeSeconds += (time.time() - timeStarted)
+        self.nEvaluations += 1
+        self.cachedValues[key] = value
+        return value
+
+    def evaluateMany(self, xValues, scanMode="scalar", processPool=None):
+        # Values at all of xValues, evaluating the points not yet in the cache together:
+        # "scalar" calls inputFunction once per point, "vectorized" calls it once with a numpy array of all the points,
+        # and "processPool" maps it over processPool (a concurrent.futures.Executor; inputFunction must then be picklable, e.g. a module-level function).
+        if not(scanMode in SCAN_MODES): raise ValueError("Error in tmStatsUtils.tmFunctionEvaluator.evaluateMany(): scanMode must be one of {sM}; currently {m}".format(sM=SCAN_MODES, m=scanMode))
+        if (scanMode == "scalar"): return [self(x) for x in xValues]
+        self.nCalls += len(xValues)
+        xValuesToEvaluate = {}
+        for x in xValues:
+            key = self.getKey(x)
+            if not((key in self.cachedValues) or (key in xValuesToEvaluate)): xValuesToEvaluate[key] = x
+        if (len(xValuesToEvaluate) > 0):
+            timeStarted = time.time()
+            if (scanMode == "vectorized"):
+                evaluatedValues = (numpy.asarray(self.inputFunction(numpy.array(list(xValuesToEvaluate.values()))), dtype=float)).tolist()
+            else:
+                if (processPool is None): raise TypeError("Error in tmStatsUtils.tmFunctionEvaluator.evaluateMany(): processPool is None in processPool mode")
+                evaluatedValues = list(processPool.map(self.inputFunction, list(xValuesToEvaluate.values())))
+            self.evaluationTimeSeconds += (time.time() - timeStarted)
+            self.nEvaluations += len(xValuesToEvaluate)
+            self.cachedValues.update(zip(xValuesToEvaluate.keys(), evaluatedValues))
+        return [self.cachedValues[self.getKey(x)] for x in xValues]
+
+    def getStatistics(self):
+        return {"nCalls": self.nCalls,
+                "nEvaluations": self.nEvaluations,
+                "nCacheHits": self.nCalls - self.nEvaluations,
+                "evaluationTimeSeconds": self.evaluationTimeSeconds}
+
+def getFunctionEvaluator(inputFunction, xRange):
+    if isinstance(inputFunction, tmFunctionEvaluator): return inputFunction
+    return tmFunctionEvaluator(inputFunction=inputFunction, xQuantum=DEFAULT_X_QUANTUM_COEFFICIENT*abs(xRange[1] - xRange[0]))
+
+def getBracketedFunctionZero(inputFunction=None, xRange=None, functionValuesAtEndpoints=None, zeroTolerance=None, xTolerance=None, maxIterations=DEFAULT_MAX_ITERATIONS, printDebug=False):
+    # Illinois variant of regula falsi: the function changes sign over xRange, and every iteration evaluates it once, at the secant estimate.
+    # Whenever an iteration fails to halve the bracket, the next one bisects it instead, so the bracket at least halves every two iterations.
+    # Stops when |f(x)| < zeroTolerance (if given) or when the bracket is narrower than xTolerance.
+    # functionValuesAtEndpoints, if already known, saves two evaluations. Returns (approximate zero, number of evaluations of inputFunction).
+    if (inputFunction is None): raise TypeError("Error in tmStatsUtils.getBracketedFunctionZero(): named argument inputFunction is None")
+    if not(callable(inputFunction)): raise TypeError("Error in tmStatsUtils.getBracketedFunctionZero(): object passed as named argument inputFunction is not callable")
+    if xRange is None: raise TypeError("Error in tmStatsUtils.getBracketedFunctionZero(): named argument xRange is None")
+    if not(len(xRange) == 2): raise TypeError("Error in tmStatsUtils.getBracketedFunctionZero(): Given argument xRange = {xR} does not have exactly two elements".format(xR=xRange))
+    xa = xRange[0]
+    xb = xRange[1]
+    if (xb <= xa): raise ValueError("Error in tmStatsUtils.getBracketedFunctionZero(): Argument xRange needs to have min strictly less than max; currently xmin = {xmin}, xmax={xmax}".format(xmin=xa, xmax=xb))
+    if (xTolerance is None): xTolerance = DEFAULT_X_TOLERANCE_COEFFICIENT*(xb - xa)
+    nEvaluations = 0
+    if (functionValuesAtEndpoints is None):
+        functionValuesAtEndpoints = (inputFunction(xa), inputFunction(xb))
+        nEvaluations += 2
+    fa, fb = functionValuesAtEndpoints
+    if (fa == 0.): return (xa, nEvaluations)
+    if (fb == 0.): return (xb, nEvaluations)
+    if ((fa > 0.) == (fb > 0.)): raise ValueError("Error in tmStatsUtils.getBracketedFunctionZero(): Given function has the same sign at either endpoint of the range {xR}: f(xmin) = {fa}, f(xmax) = {fb}".format(xR=xRange, fa=fa, fb=fb))
+    lastEndpointMoved = None # "a" or "b"
+    bisectNext = False
+    xc = 0.5*(xa + xb)
+    for iteration in range(maxIterations):
+        bracketWidth = xb - xa
+        if bracketWidth < xTolerance:
+            if printDebug: print("Bracket [{xa}, {xb}] narrower than tolerance {xT} after {n} evaluations.".format(xa=xa, xb=xb, xT=xTolerance, n=nEvaluations))
+            return (xc, nEvaluations)
+        xc = (xa*fb - xb*fa)/(fb - fa)
+        if (bisectNext or not(xa < xc < xb)): xc = 0.5*(xa + xb)
+        fc = inputFunction(xc)
+        nEvaluations += 1
+        if printDebug: print("Iteration {i}: f({xc}) = {fc}, bracket: [{xa}, {xb}]".format(i=iteration, xc=xc, fc=fc, xa=xa, xb=xb))
+        if ((fc == 0.) or (not(zeroTolerance is None) and (abs(fc) < zeroTolerance))):
+            if printDebug: print("Found zero within tolerance at {xc} after {n} evaluations.".format(xc=xc, n=nEvaluations))
+            return (xc, nEvaluations)
+        if ((fc > 0.) == (fb > 0.)):
+            xb, fb = xc, fc
+            if (lastEndpointMoved == "b"): fa *= 0.5 # Illinois modification: stops the same endpoint from being kept forever
+            lastEndpointMoved = "b"
+        else:
+            xa, fa = xc, fc
+            if (lastEndpointMoved == "a"): fb *= 0.5
+            lastEndpointMoved = "a"
+        bisectNext = ((xb - xa) > 0.5*bracketWidth)
+    print("WARNING in tmStatsUtils.getBracketedFunctionZero(): no convergence after {n} iterations; returning {xc}, bracket: [{xa}, {xb}]".format(n=maxIterations, xc=xc, xa=xa, xb=xb))
+    return (xc, nEvaluations)
+
+def getMonotonicFunctionApproximateZero(inputFunction=None, xRange=None, zeroTolerance=None, autoZeroTolerance=False, xTolerance=None, maxIterations=DEFAULT_MAX_ITERATIONS, printDebug=False):
     if (printDebug): print("getMonotonicFunctionApproximateZero called for xRange = {xR}, zeroTolerance={zT}".format(xR=xRange, zT=zeroTolerance))
     if (inputFunction is None): raise TypeError("Error in tmStatsUtils.getMonotonicFunctionApproximateZero(): named argument inputFunction is None")
     if not(callable(inputFunction)): raise TypeError("Error in tmStatsUtils.getMonotonicFunctionApproximateZero(): object passed as named argument inputFunction is not callable")
@@ -17,6 +137,7 @@ def getMonotonicFunctionApproximateZero(inputFunction=None, xRange=None, zeroTol
     xmin = xRange[0]
     xmax = xRange[1]
     if (xmax <= xmin): raise ValueError("Error in tmStatsUtils.getMonotonicFunctionApproximateZero(): Argument xRange needs to have min strictly less than max; currently xmin = {xmin}, xmax={xmax}".format(xmin=xmin, xmax=xmax))
+    inputFunction = getFunctionEvaluator(inputFunction, xRange)
 
     fmin = inputFunction(xmin)
     fmax = inputFunction(xmax)
@@ -43,11 +164,20 @@ def getMonotonicFunctionApproximateZero(inputFunction=None, xRange=None, zeroTol
     else:
         if printDebug:
             print("Midpoint not yet within zero tolerance, trying new range.")
+    # Continue from the half of the range containing the zero, reusing the three values already computed
     nextRange=[]
-    if ((monotonicityUp and fmid > 0.) or (not(monotonicityUp) and fmid < 0.)): nextRange = [xmin, xmid]
-    elif((monotonicityUp and fmid < 0.) or (not(monotonicityUp) and fmid > 0.)): nextRange = [xmid, xmax]
+    nextFunctionValuesAtEndpoints=None
+    if ((monotonicityUp and fmid > 0.) or (not(monotonicityUp) and fmid < 0.)):
+        nextRange = [xmin, xmid]
+        nextFunctionValuesAtEndpoints = (fmin, fmid)
+    elif((monotonicityUp and fmid < 0.) or (not(monotonicityUp) and fmid > 0.)):
+        nextRange = [xmid, xmax]
+        nextFunctionValuesAtEndpoints = (fmid, fmax)
     else: sys.exit("Error in tmStatsUtils.getMonotonicFunctionApproximateZero(): Unknown logic error")
-    return getMonotonicFunctionApproximateZero(inputFunction=inputFunction, xRange=nextRange, zeroTolerance=zeroTolerance, printDebug=printDebug)
+    if (xTolerance is None): xTolerance = DEFAULT_X_TOLERANCE_COEFFICIENT*(xmax - xmin)
+    approximateZero, nEvaluations = getBracketedFunctionZero(inputFunction=inputFunction, xRange=nextRange, functionValuesAtEndpoints=nextFunctionValuesAtEndpoints, zeroTolerance=zeroTolerance, xTolerance=xTolerance, maxIterations=maxIterations, printDebug=printDebug)
+    if printDebug: print("Zero found at {x} with {n} function evaluations in total.".format(x=approximateZero, n=3+nEvaluations))
+    return approximateZero
 
 def getStrictlyConvexFunctionApproximateMinimum(inputFunction=None, xRange=None, zeroTolerance=None, autoZeroTolerance=False, printDebug=False):
     if (printDebug): print("getStrictlyConvexFunctionApproximateMinimum called for xRange = {xR}, zeroTolerance={zT}".format(xR=xRange, zT=zeroTolerance))
@@ -60,6 +190,7 @@ def getStrictlyConvexFunctionApproximateMinimum(inputFunction=None, xRange=None,
     xmin = xRange[0]
     xmax = xRange[1]
     if (xmax <= xmin): raise ValueError("Error in tmStatsUtils.getStrictlyConvexFunctionApproximateMinimum(): Argument xRange needs to have min strictly less than max; currently xmin = {xmin}, xmax={xmax}".format(xmin=xmin, xmax=xmax))
+    inputFunction = getFunctionEvaluator(inputFunction, xRange)
 
     # Finding the minimum of a strictly convex function is the same problem as finding the zero of its slope, which should be monotonically increasing
     # In principle, this function could be easily modified to work with strictly concave functions -- just multiply by -1 -- but I don't need that now :-D
@@ -70,30 +201,54 @@ def getStrictlyConvexFunctionApproximateMinimum(inputFunction=None, xRange=None,
         return ((inputFunction(x+delta_x) - inputFunction(x-delta_x))/(2*delta_x))
 
     if (printDebug): print("Now passing slope of function to getMonotonicFunctionApproximateZero:")
-    return getMonotonicFunctionApproximateZero(inputFunction=functionSlope, xRange=xRange, zeroTolerance=zeroTolerance, autoZeroTolerance=autoZeroTolerance, printDebug=printDebug)
+    approximateMinimum = getMonotonicFunctionApproximateZero(inputFunction=functionSlope, xRange=xRange, zeroTolerance=zeroTolerance, autoZeroTolerance=autoZeroTolerance, printDebug=printDebug)
+    if (printDebug): print("Function evaluation statistics: {s}".format(s=inputFunction.getStatistics()))
+    return approximateMinimum
 
-def getGlobalMinimum(inputFunction=None, xRange=None, zeroTolerance=None, autoZeroTolerance=False, printDebug=False):
+def getGlobalMinimum(inputFunction=None, xRange=None, zeroTolerance=None, autoZeroTolerance=False, scanMode="scalar", nProcesses=None, adaptiveScan=True, printDebug=False):
     # Works for functions that have a well-defined minimum but are not necessarily convex throughout xRange
+    # scanMode: how the points of the initial scan are evaluated, see tmFunctionEvaluator.evaluateMany; "processPool" uses nProcesses processes (default: number of CPUs).
+    # With adaptiveScan, the scan starts on a coarse grid and is refined only around its local minima, down to the resolution of the full scan (1% of xRange).
     if (printDebug): print("getGlobalMinimum called for xRange = {xR}, zeroTolerance={zT}".format(xR=xRange, zT=zeroTolerance))
-    if (inputFunction is None): raise TypeError("Error in tmStatsUtils.getStrictlyConvexFunctionApproximateMinimum(): named argument inputFunction is None")
-    if not(callable(inputFunction)): raise TypeError("Error in tmStatsUtils.getStrictlyConvexFunctionApproximateMinimum(): object passed as named argument inputFunction is not callable")
+    if (inputFunction is None): raise TypeError("Error in tmStatsUtils.getGlobalMinimum(): named argument inputFunction is None")
+    if not(callable(inputFunction)): raise TypeError("Error in tmStatsUtils.getGlobalMinimum(): object passed as named argument inputFunction is not callable")
 
-    if xRange is None: raise TypeError("Error in tmStatsUtils.getStrictlyConvexFunctionApproximateMinimum(): named argument xRange is None")
-    if not(len(xRange) == 2): raise TypeError("Error in tmStatsUtils.getStrictlyConvexFunctionApproximateMinimum(): Given argument xRange = {xR} does not have exactly two elements".format(xR=xRange))
+    if xRange is None: raise TypeError("Error in tmStatsUtils.getGlobalMinimum(): named argument xRange is None")
+    if not(len(xRange) == 2): raise TypeError("Error in tmStatsUtils.getGlobalMinimum(): Given argument xRange = {xR} does not have exactly two elements".format(xR=xRange))
+    if not(scanMode in SCAN_MODES): raise ValueError("Error in tmStatsUtils.getGlobalMinimum(): scanMode must be one of {sM}; currently {m}".format(sM=SCAN_MODES, m=scanMode))
 
     xmin = xRange[0]
     xmax = xRange[1]
-    if (xmax <= xmin): raise ValueError("Error in tmStatsUtils.getStrictlyConvexFunctionApproximateMinimum(): Argument xRange needs to have min strictly less than max; currently xmin = {xmin}, xmax={xmax}".format(xmin=xmin, xmax=xmax))
+    if (xmax <= xmin): raise ValueError("Error in tmStatsUtils.getGlobalMinimum(): Argument xRange needs to have min strictly less than max; currently xmin = {xmin}, xmax={xmax}".format(xmin=xmin, xmax=xmax))
+    inputFunction = getFunctionEvaluator(inputFunction, xRange) # the refinement below reuses the values from the scan
 
-    # Step 1: find location of global minimum by stepping through the data
-    globalMinimum = None
-    globalMinimumX = None
-    for xcounter in range(0, 101):
-        xvalue = xmin + (xcounter/100)*(xmax - xmin)
-        functionValue = inputFunction(xvalue)
-        if ((globalMinimum is None) or (functionValue < globalMinimum)):
-            globalMinimum = functionValue
-            globalMinimumX = xvalue
+    # Step 1: find location of global minimum by stepping through the data. Points are indexed by their position on the finest grid.
+    def getXValue(gridIndex):
+        return xmin + (gridIndex/DEFAULT_N_SCAN_INTERVALS)*(xmax - xmin)
+    processPool = None
+    if (scanMode == "processPool"): processPool = concurrent.futures.ProcessPoolExecutor(max_workers=nProcesses)
+    try:
+        scanStep = (DEFAULT_INITIAL_SCAN_STEP_INTERVALS if adaptiveScan else 1)
+        gridIndicesToEvaluate = sorted(set(list(range(0, DEFAULT_N_SCAN_INTERVALS, scanStep)) + [DEFAULT_N_SCAN_INTERVALS]))
+        scanValues = {}
+        while True:
+            scanValues.update(zip(gridIndicesToEvaluate, inputFunction.evaluateMany([getXValue(gridIndex) for gridIndex in gridIndicesToEvaluate], scanMode=scanMode, processPool=processPool)))
+            if (scanStep == 1): break
+            scanStep = scanStep//2
+            # Local minima among the points evaluated so far, including the endpoints; their neighbours on the next finer grid are evaluated next
+            sortedGridIndices = sorted(scanValues.keys())
+            gridIndicesToEvaluate = set()
+            for positionInScan, gridIndex in enumerate(sortedGridIndices):
+                if ((positionInScan > 0) and (scanValues[sortedGridIndices[positionInScan-1]] < scanValues[gridIndex])): continue
+                if ((positionInScan < len(sortedGridIndices) - 1) and (scanValues[sortedGridIndices[positionInScan+1]] < scanValues[gridIndex])): continue
+                for neighbourGridIndex in [gridIndex - scanStep, gridIndex + scanStep]:
+                    if ((0 <= neighbourGridIndex <= DEFAULT_N_SCAN_INTERVALS) and not(neighbourGridIndex in scanValues)): gridIndicesToEvaluate.add(neighbourGridIndex)
+            gridIndicesToEvaluate = sorted(gridIndicesToEvaluate)
+    finally:
+        if not(processPool is None): processPool.shutdown(wait=True)
+    globalMinimumGridIndex = min(sorted(scanValues.keys()), key=(lambda gridIndex: scanValues[gridIndex])) # lowest x among equal values, as in the full scan
+    globalMinimumX = getXValue(globalMinimumGridIndex)
+    if (printDebug): print("Scan evaluated the function at {n} points; lowest value found at x = {x}".format(n=len(scanValues), x=globalMinimumX))
     # Step 2: assume that the function will be convex over 5% of the input range at least (if not, the following will throw an exception)
     return getStrictlyConvexFunctionApproximateMinimum(inputFunction=inputFunction, xRange=[globalMinimumX - 0.025*(xmax - xmin), globalMinimumX + 0.025*(xmax - xmin)], zeroTolerance=zeroTolerance, autoZeroTolerance=autoZeroTolerance, printDebug=printDebug)
 
@@ -119,6 +274,32 @@ def get_pVal_of_alternative_with_wilks(nll_null, nll_alternative, n_extra_parame
     t = 2*(nll_null-nll_alternative)
     return (scipy.stats.chi2.cdf(t, n_extra_parameters_in_alternative))
 
+# Batch versions of the two functions above, for comparing many pairs of fits at once: the inputs can be arrays (or scalars, broadcast against the arrays),
+# and the outputs are numpy structured arrays with one row per pair, containing the inputs, the test statistics and the p-values.
+def get_fTest_probs(chi2_1, chi2_2, ndf_1, ndf_2):
+    chi2_1, chi2_2, ndf_1, ndf_2 = numpy.broadcast_arrays(numpy.atleast_1d(numpy.asarray(chi2_1, dtype=float)), numpy.asarray(chi2_2, dtype=float), numpy.asarray(ndf_1, dtype=float), numpy.asarray(ndf_2, dtype=float))
+    fTestTable = numpy.zeros(chi2_1.shape, dtype=[("chi2_1", float), ("chi2_2", float), ("ndf_1", float), ("ndf_2", float), ("d1", float), ("d2", float), ("fStat", float), ("fProb", float)])
+    fTestTable["chi2_1"] = chi2_1
+    fTestTable["chi2_2"] = chi2_2
+    fTestTable["ndf_1"] = ndf_1
+    fTestTable["ndf_2"] = ndf_2
+    fTestTable["d1"] = ndf_1 - ndf_2
+    fTestTable["d2"] = ndf_2
+    with numpy.errstate(divide="ignore", invalid="ignore"): # a pair with d1 or d2 equal to 0 gets nan or inf, rather than stopping the whole batch
+        fTestTable["fStat"] = ((chi2_1 - chi2_2)/fTestTable["d1"])/(chi2_2/fTestTable["d2"])
+    fTestTable["fProb"] = scipy.stats.f.cdf(fTestTable["fStat"], fTestTable["d1"], fTestTable["d2"])
+    return fTestTable
+
+def get_pVals_of_alternatives_with_wilks(nll_null, nll_alternative, n_extra_parameters_in_alternative):
+    nll_null, nll_alternative, n_extra_parameters_in_alternative = numpy.broadcast_arrays(numpy.atleast_1d(numpy.asarray(nll_null, dtype=float)), numpy.asarray(nll_alternative, dtype=float), numpy.asarray(n_extra_parameters_in_alternative, dtype=float))
+    wilksTable = numpy.zeros(nll_null.shape, dtype=[("nll_null", float), ("nll_alternative", float), ("n_extra_parameters_in_alternative", float), ("t", float), ("pVal", float)])
+    wilksTable["nll_null"] = nll_null
+    wilksTable["nll_alternative"] = nll_alternative
+    wilksTable["n_extra_parameters_in_alternative"] = n_extra_parameters_in_alternative
+    wilksTable["t"] = 2*(nll_null - nll_alternative)
+    wilksTable["pVal"] = scipy.stats.chi2.cdf(wilksTable["t"], n_extra_parameters_in_alternative)
+    return wilksTable
+
 def tmStatsUtilsTest():
     print("Beginning tests:")
     nColumns = os.getenv("COLUMNS")
@@ -144,5 +325,37 @@ def tmStatsUtilsTest():
     print("Expected: -0.25, found: {tM}".format(tM=testMinimum))
     print("~"*nColumns)
 
+    print("Tests for tmFunctionEvaluator:")
+    testEvaluator = tmFunctionEvaluator(inputFunction=testForApproximateMinimum, xQuantum=1.e-12)
+    for testCounter in range(2):
+        testMinimum = getStrictlyConvexFunctionApproximateMinimum(inputFunction=testEvaluator, xRange=[-1.2, 1.1], autoZeroTolerance=True)
+        print("Expected: -0.25, found: {tM}; statistics: {s}".format(tM=testMinimum, s=testEvaluator.getStatistics()))
+    print("Expected: as many evaluations after the second minimization as after the first.")
+    print("~"*nColumns)
+
+    print("Tests for getGlobalMinimum:")
+    def testForGlobalMinimum(x):
+        return ((x*x - 0.36)*(x*x - 0.36) + 0.1*x) # double well: local minimum near x = 0.57, global minimum near x = -0.63
+    for scanMode in ["scalar", "vectorized"]:
+        for adaptiveScan in [False, True]:
+            testEvaluator = tmFunctionEvaluator(inputFunction=testForGlobalMinimum, xQuantum=1.e-12)
+            testMinimum = getGlobalMinimum(inputFunction=testEvaluator, xRange=[-1.2, 1.1], autoZeroTolerance=True, scanMode=scanMode, adaptiveScan=adaptiveScan)
+            print("scanMode: {sM}, adaptiveScan: {aS}. Found: {tM}; number of evaluations: {n}".format(sM=scanMode, aS=adaptiveScan, tM=testMinimum, n=testEvaluator.getStatistics()["nEvaluations"]))
+    print("Expected: the same minimum in all cases, with fewer evaluations for the adaptive scans.")
+    print("~"*nColumns)
+
+    print("Tests for get_fTest_probs and get_pVals_of_alternatives_with_wilks:")
+    testChi2s_1 = [120.0, 95.5, 80.2]
+    testChi2s_2 = [110.0, 94.9, 70.1]
+    testNdfs_1 = [50, 48, 46]
+    testNdfs_2 = [48, 47, 44]
+    fTestTable = get_fTest_probs(testChi2s_1, testChi2s_2, testNdfs_1, testNdfs_2)
+    wilksTable = get_pVals_of_alternatives_with_wilks(testChi2s_1, testChi2s_2, [2, 1, 2])
+    for pairIndex in range(len(testChi2s_1)):
+        print("Batch F-test probability: {b}, scalar: {s}".format(b=fTestTable["fProb"][pairIndex], s=get_fTest_prob(testChi2s_1[pairIndex], testChi2s_2[pairIndex], testNdfs_1[pairIndex], testNdfs_2[pairIndex])))
+        print("Batch Wilks p-value: {b}, scalar: {s}".format(b=wilksTable["pVal"][pairIndex], s=get_pVal_of_alternative_with_wilks(testChi2s_1[pairIndex], testChi2s_2[pairIndex], [2, 1, 2][pairIndex])))
+    print("Expected: identical batch and scalar values.")
+    print("~"*nColumns)
+
 if __name__ == "__main__":
     tmStatsUtilsTest()
@@ -2,11 +2,24 @@ import sys
 if (sys.version_info.major < 3): sys.exit("Must be using py3 onwards. Current version info: {v}".format(v=sys.version_info))
 if (sys.version_info.minor < 6): sys.exit("Must be using python 3.6 onwards. Current version info: {v}".format(v=sys.version_info))
 
-import os, subprocess
-from typing import List, Tuple
+import os, subprocess, time, json, heapq, zlib, atexit, threading, concurrent.futures
+from typing import Dict, List, Tuple, Union
 
 import tmProgressBar
 
+DEFAULT_MAX_PARALLEL_QUERIES = 16
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_RETRY_BACKOFF_SECONDS = 1.0
+DEFAULT_MAX_PARALLEL_TRANSFERS = 4
+DEFAULT_MAX_PARALLEL_LOCAL_CHECKSUMS = 2
+CLONE_JOURNAL_FILE_NAME = ".tmXRootUtils_clone_journal"
+ADLER32_CHUNK_SIZE_BYTES = 8*1024*1024
+LOCAL_CHECKSUMS_CACHE_PATH = os.getenv("TMXROOTUTILS_CHECKSUMS_CACHE", os.path.expanduser("~/.tmXRootUtils_local_checksums_cache.json"))
+
+local_checksums_cache = None # maps real path to [size, mtime_ns, inode, checksum]; loaded on first use
+local_checksums_cache_is_modified = False
+local_checksums_cache_lock = threading.Lock()
+
 def Parse_xrdfs_ls_OutputLine(xrdfs_ls_output_line: str) -> Tuple[bool, str]:
     output_line_split = (xrdfs_ls_output_line.strip()).split()
     if not(len(output_line_split) == 5): sys.exit("ERROR: Unable to parse xrdfs line: {l}".format(l=xrdfs_ls_output_line))
@@ -14,6 +27,21 @@ def Parse_xrdfs_ls_OutputLine(xrdfs_ls_output_line: str) -> Tuple[bool, str]:
     full_path = output_line_split[4]
     return (is_directory, full_path)
 
+def Parse_xrdfs_ls_OutputLineDetails(xrdfs_ls_output_line: str) -> Dict[str, Union[str, int, bool]]:
+    output_line_split = (xrdfs_ls_output_line.strip()).split()
+    if not(len(output_line_split) == 5): sys.exit("ERROR: Unable to parse xrdfs line: {l}".format(l=xrdfs_ls_output_line))
+    return {"name": os.path.basename(output_line_split[4]),
+            "isDirectory": (output_line_split[0][0] == 'd'),
+            "isFile": not(output_line_split[0][0] == 'd'),
+            "size": int(output_line_split[3]),
+            "mtime": "{d} {t}".format(d=output_line_split[1], t=output_line_split[2]),
+            "mtimeSeconds": time.mktime(time.strptime("{d} {t}".format(d=output_line_split[1], t=output_line_split[2]), "%Y-%m-%d %H:%M:%S"))}
+
+def List_xrdfs_Directory(xrd_prefix: str, directory_path_without_xrd_prefix: str) -> List[Dict[str, Union[str, int, bool]]]:
+    # Non-recursive listing, in the same format as tmEOSUtils.list_eos_directory
+    xrdfs_ls_output = subprocess.check_output("xrdfs {p} ls -l {d}".format(p=xrd_prefix, d=directory_path_without_xrd_prefix), shell=True, universal_newlines=True, executable="/bin/bash")
+    return [Parse_xrdfs_ls_OutputLineDetails(line) for line in xrdfs_ls_output.splitlines() if (len(line.strip()) > 0)]
+
 def Query_xrdfs_adler32(xrd_prefix: str, file_full_path: str) -> str:
     query_output = subprocess.check_output("xrdfs {p} query checksum {f}".format(p=xrd_prefix, f=file_full_path), shell=True, universal_newlines=True, executable="/bin/bash")
     query_output_split = (query_output.strip()).split()
@@ -21,74 +49,200 @@ def Query_xrdfs_adler32(xrd_prefix: str, file_full_path: str) -> str:
     if not(query_output_split[0] == "adler32"): sys.exit("ERROR: xrdfs checksum returns it in an unexpected format: {f}".format(f=query_output_split[0]))
     return query_output_split[1]
 
-def GetLocal_adler32(local_file_path: str) -> str:
-    adler32_output = subprocess.check_output("xrdadler32 {f}".format(f=local_file_path), shell=True, universal_newlines=True, executable="/bin/bash")
-    adler32_output_split = (adler32_output.strip()).split()
-    if not(len(adler32_output_split) == 2): sys.exit("ERROR: adler32 output not in expected format: {o}".format(o=adler32_output))
-    if not(adler32_output_split[1] == local_file_path): sys.exit("ERROR: adler32 output not in expected format: {o}".format(o=adler32_output))
-    return adler32_output_split[0]
+def Query_xrdfs_adler32_WithRetries(xrd_prefix: str, file_full_path: str, max_retries: int, retry_backoff_seconds: float) -> str:
+    # Exponential backoff between attempts: retry_backoff_seconds, 2*retry_backoff_seconds, 4*retry_backoff_seconds, ...
+    for attempt_index in range(1+max_retries):
+        try:
+            return Query_xrdfs_adler32(xrd_prefix, file_full_path)
+        except subprocess.CalledProcessError:
+            if (attempt_index == max_retries): raise
+            time.sleep(retry_backoff_seconds*pow(2, attempt_index))
+
+def Compute_adler32(local_file_path: str) -> str:
+    # Same output as xrdadler32, without forking a process; zlib releases the GIL on large buffers, so this can run in threads
+    adler32_value = 1
+    with open(local_file_path, 'rb') as local_file_handle:
+        while True:
+            chunk = local_file_handle.read(ADLER32_CHUNK_SIZE_BYTES)
+            if (len(chunk) == 0): break
+            adler32_value = zlib.adler32(chunk, adler32_value)
+    return "{v:08x}".format(v=(adler32_value & 0xffffffff))
+
+def LoadLocalChecksumsCache() -> None:
+    # Must be called with local_checksums_cache_lock held
+    global local_checksums_cache
+    if not(local_checksums_cache is None): return
+    local_checksums_cache = {}
+    if os.path.isfile(LOCAL_CHECKSUMS_CACHE_PATH):
+        try:
+            with open(LOCAL_CHECKSUMS_CACHE_PATH, 'r') as cache_file_handle:
+                local_checksums_cache = json.load(cache_file_handle)
+        except ValueError:
+            print("WARNING: unable to parse local checksums cache {c}, starting from an empty cache.".format(c=LOCAL_CHECKSUMS_CACHE_PATH))
+    atexit.register(SaveLocalChecksumsCache)
+
+def SaveLocalChecksumsCache() -> None:
+    global local_checksums_cache_is_modified
+    with local_checksums_cache_lock:
+        if not(local_checksums_cache_is_modified): return
+        # Write to a temporary file and rename, so that an interrupted save never leaves a truncated cache behind
+        temporary_cache_path = "{c}.tmp{pid}".format(c=LOCAL_CHECKSUMS_CACHE_PATH, pid=os.getpid())
+        with open(temporary_cache_path, 'w') as cache_file_handle:
+            json.dump(local_checksums_cache, cache_file_handle)
+        os.replace(temporary_cache_path, LOCAL_CHECKSUMS_CACHE_PATH)
+        local_checksums_cache_is_modified = False
 
-def GetListOfFilesInDirectory(xrd_prefix: str, directory_path_without_xrd_prefix: str, print_verbose: bool) -> List[Tuple[str, str]]:
+def GetLocal_adler32(local_file_path: str, use_cache: bool = True) -> str:
+    # A cached checksum is reused only if the file's size, mtime and inode are all unchanged
+    if not(use_cache): return Compute_adler32(local_file_path)
+    global local_checksums_cache_is_modified
+    real_path = os.path.realpath(local_file_path)
+    local_file_stat = os.stat(real_path)
+    file_signature = [local_file_stat.st_size, local_file_stat.st_mtime_ns, local_file_stat.st_ino]
+    with local_checksums_cache_lock:
+        LoadLocalChecksumsCache()
+        cached_entry = local_checksums_cache.get(real_path)
+        if (not(cached_entry is None) and (cached_entry[:3] == file_signature)): return cached_entry[3]
+    checksum_value = Compute_adler32(real_path)
+    with local_checksums_cache_lock:
+        local_checksums_cache[real_path] = file_signature + [checksum_value]
+        local_checksums_cache_is_modified = True
+    return checksum_value
+
+def GetListOfFilesWithSizesInDirectory(xrd_prefix: str, directory_path_without_xrd_prefix: str, print_verbose: bool, max_parallel_queries: int = DEFAULT_MAX_PARALLEL_QUERIES, max_retries: int = DEFAULT_MAX_RETRIES, retry_backoff_seconds: float = DEFAULT_RETRY_BACKOFF_SECONDS) -> List[Tuple[str, int, str]]:
     if print_verbose: print("Getting list of files and checksums from remote server...")
     xrdfs_ls_output = subprocess.check_output("xrdfs {p} ls -l -R {d}".format(p=xrd_prefix, d=directory_path_without_xrd_prefix), shell=True, universal_newlines=True, executable="/bin/bash")
-    list_of_files = []
-    xrdfs_ls_output_nlines = xrdfs_ls_output.count(os.linesep)
-    progressBar = tmProgressBar.tmProgressBar(counterMaxValue=xrdfs_ls_output_nlines)
-    line_index = 1
-    line_index_refresh_freq = max(1, xrdfs_ls_output_nlines//100)
-    progressBar.initializeTimer()
+    full_paths = []
+    partial_paths = []
+    sizes = []
     for line in xrdfs_ls_output.splitlines():
-        if (len(line) == 0):
-            line_index += 1
-            continue
+        if (len(line) == 0): continue
         is_directory, full_path = Parse_xrdfs_ls_OutputLine(line)
-        if is_directory:
-            line_index += 1
-            continue
-        adler32_checksum_value = Query_xrdfs_adler32(xrd_prefix, full_path)
+        if is_directory: continue
+        sizes.append(Parse_xrdfs_ls_OutputLineDetails(line)["size"])
         if not(full_path[:len(directory_path_without_xrd_prefix)] == directory_path_without_xrd_prefix):
             sys.exit("ERROR: xrdfs ls output path {p} does not start with expected directory: {d}".format(p=full_path, d=directory_path_without_xrd_prefix))
         partial_path = full_path[len(directory_path_without_xrd_prefix):] # get path relative to parent directory
         while (partial_path[0] == "/"):
             partial_path = partial_path[1:] # remove any leading slashes
-        list_of_files.append((partial_path, adler32_checksum_value))
-        if ((line_index == 1) or
-            (line_index % line_index_refresh_freq == 0) or
-            (line_index == xrdfs_ls_output_nlines)): progressBar.updateBar(fractionCompleted=line_index/xrdfs_ls_output_nlines, counterCurrentValue=line_index)
-        line_index += 1
+        full_paths.append(full_path)
+        partial_paths.append(partial_path)
+    n_files = len(full_paths)
+    if (n_files == 0): return []
+    # Checksum queries are independent round trips to the server: run up to max_parallel_queries of them at once
+    checksum_values = [None]*n_files
+    progressBar = tmProgressBar.tmProgressBar(counterMaxValue=n_files)
+    progressBar.initializeTimer()
+    queries_pool = concurrent.futures.ThreadPoolExecutor(max_workers=max_parallel_queries)
+    query_to_file_index = {queries_pool.submit(Query_xrdfs_adler32_WithRetries, xrd_prefix, full_path, max_retries, retry_backoff_seconds): file_index for file_index, full_path in enumerate(full_paths)}
+    try:
+        for query in concurrent.futures.as_completed(query_to_file_index):
+            checksum_values[query_to_file_index[query]] = query.result() # results stored by file index, so the output order does not depend on completion order
+            progressBar.update()
+    finally:
+        for query in query_to_file_index:
+            query.cancel()
+        queries_pool.shutdown(wait=True)
     progressBar.terminate()
-    return list_of_files
+    return list(zip(partial_paths, sizes, checksum_values))
+
+def GetListOfFilesInDirectory(xrd_prefix: str, directory_path_without_xrd_prefix: str, print_verbose: bool, max_parallel_queries: int = DEFAULT_MAX_PARALLEL_QUERIES, max_retries: int = DEFAULT_MAX_RETRIES, retry_backoff_seconds: float = DEFAULT_RETRY_BACKOFF_SECONDS) -> List[Tuple[str, str]]:
+    return [(partial_path, checksum_value) for partial_path, size, checksum_value in GetListOfFilesWithSizesInDirectory(xrd_prefix, directory_path_without_xrd_prefix, print_verbose, max_parallel_queries, max_retries, retry_backoff_seconds)]
+
+def ReadCloneJournal(journal_file_path: str) -> Dict[str, Dict[str, Union[str, int]]]:
+    # Later entries for the same relative path override earlier ones
+    journal_entries = {}
+    if not(os.path.isfile(journal_file_path)): return journal_entries
+    with open(journal_file_path, 'r') as journal_file_handle:
+        for line in journal_file_handle:
+            if (len(line.strip()) == 0): continue
+            try:
+                journal_entry = json.loads(line)
+            except ValueError: # e.g. last line truncated by an interrupted run
+                continue
+            journal_entries[journal_entry["relative_path"]] = journal_entry
+    return journal_entries
 
-def CloneDirectoryLocally(xrd_prefix_remote: str, remote_path_without_xrd_prefix: str, path_local: str, print_verbose: bool) -> None:
+def IsUnchangedSinceJournaled(local_file_path: str, checksum_value: str, journal_entry: Dict[str, Union[str, int]]) -> bool:
+    if not(journal_entry["checksum"] == checksum_value): return False
+    try:
+        local_file_stat = os.stat(local_file_path)
+    except OSError:
+        return False
+    return ((local_file_stat.st_size == journal_entry["size"]) and (local_file_stat.st_mtime_ns == journal_entry["mtime_ns"]))
+
+def CopyFromRemote(xrd_prefix_remote: str, remote_path_without_xrd_prefix: str, path_local: str, relative_path: str, streams_per_transfer: int) -> None:
+    xrd_copy_command = "xrdcp --silent --nopbar --force --path --streams {s} {pref}//{parent}/{relpath} {outputdir}/{relpath}".format(s=streams_per_transfer, pref=xrd_prefix_remote, parent=remote_path_without_xrd_prefix, relpath=relative_path, outputdir=path_local)
+    subprocess.check_call(xrd_copy_command, shell=True, executable="/bin/bash")
+
+def CloneDirectoryLocally(xrd_prefix_remote: str, remote_path_without_xrd_prefix: str, path_local: str, print_verbose: bool,
+                          max_parallel_transfers: int = DEFAULT_MAX_PARALLEL_TRANSFERS, max_parallel_local_checksums: int = DEFAULT_MAX_PARALLEL_LOCAL_CHECKSUMS, streams_per_transfer: int = 15,
+                          journal_file_path: str = None) -> None:
+    # Copies run on one pool and local checksums on another, so that verifying one file overlaps with copying the next ones.
+    # Transfers are started largest first. Every verified file is recorded in a journal; when the clone is re-run, journaled files
+    # whose local size and mtime have not changed since are skipped without being checksummed again.
     if not(os.path.isdir(path_local)): subprocess.check_call("mkdir -p {p}".format(p=path_local), shell=True, executable="/bin/bash")
-    file_details = GetListOfFilesInDirectory(xrd_prefix_remote, remote_path_without_xrd_prefix, print_verbose)
-    progressBar = tmProgressBar.tmProgressBar(counterMaxValue=len(file_details))
-    file_index = 1
-    file_index_refresh_freq = max(1, len(file_details)//100)
+    if (journal_file_path is None): journal_file_path = "{o}/{j}".format(o=path_local, j=CLONE_JOURNAL_FILE_NAME)
+    journal_entries = ReadCloneJournal(journal_file_path)
+    file_details = GetListOfFilesWithSizesInDirectory(xrd_prefix_remote, remote_path_without_xrd_prefix, print_verbose)
+    n_files = len(file_details)
+    if (n_files == 0): return
+    progressBar = tmProgressBar.tmProgressBar(counterMaxValue=n_files)
     progressBar.initializeTimer()
-    for relative_path, checksum_value in file_details:
-        needs_update = True
-        if print_verbose: print("Copying: {r}".format(r=relative_path))
-        if os.path.isfile("{o}/{r}".format(o=path_local, r=relative_path)):
-            local_checksum_value = GetLocal_adler32("{o}/{r}".format(o=path_local, r=relative_path))
-            if (local_checksum_value == checksum_value):
-                needs_update = False
-        if print_verbose:
-            if needs_update:
-                print("File {o}/{r} does not exist or has the wrong checksum. Copying...".format(o=path_local, r=relative_path))
+    transfers_pool = concurrent.futures.ThreadPoolExecutor(max_workers=max_parallel_transfers)
+    checksums_pool = concurrent.futures.ThreadPoolExecutor(max_workers=max_parallel_local_checksums)
+    transfers_queue = [] # heap of (-size, relative_path, checksum_value): largest files first
+    pending_tasks = {} # future -> (task type, relative_path, size, checksum_value)
+    n_transfers_in_flight = 0
+    journal_file_handle = open(journal_file_path, 'a')
+
+    def mark_finished(relative_path: str, size: int, checksum_value: str, record_in_journal: bool) -> None:
+        if record_in_journal:
+            local_file_stat = os.stat("{o}/{r}".format(o=path_local, r=relative_path))
+            journal_file_handle.write(json.dumps({"relative_path": relative_path, "checksum": checksum_value, "size": local_file_stat.st_size, "mtime_ns": local_file_stat.st_mtime_ns}) + "\n")
+            journal_file_handle.flush()
+        progressBar.update()
+
+    try:
+        for relative_path, size, checksum_value in sorted(file_details, key=(lambda details: details[1]), reverse=True):
+            local_file_path = "{o}/{r}".format(o=path_local, r=relative_path)
+            if ((relative_path in journal_entries) and IsUnchangedSinceJournaled(local_file_path, checksum_value, journal_entries[relative_path])):
+                if print_verbose: print("File {f} was already cloned and has not changed since. Skipping!".format(f=local_file_path))
+                mark_finished(relative_path, size, checksum_value, record_in_journal=False)
+            elif os.path.isfile(local_file_path):
+                pending_tasks[checksums_pool.submit(GetLocal_adler32, local_file_path)] = ("precheck", relative_path, size, checksum_value)
             else:
-                print("File {o}/{r} already exists and has the right checksum. Skipping!".format(o=path_local, r=relative_path))
-        if not(needs_update):
-            file_index += 1
-            continue
-        xrd_copy_command = "xrdcp --silent --nopbar --force --path --streams 15 {pref}//{parent}/{relpath} {outputdir}/{relpath}".format(pref=xrd_prefix_remote, parent=remote_path_without_xrd_prefix, relpath=relative_path, outputdir=path_local)
-        subprocess.check_call(xrd_copy_command, shell=True, executable="/bin/bash")
-        local_checksum_value = GetLocal_adler32("{o}/{r}".format(o=path_local, r=relative_path))
-        if (not(checksum_value == local_checksum_value)): sys.exit("ERROR: Checksums do not match after copying file with relative path: {p}".format(p=relative_path))
-        if ((file_index == 1) or
-            (file_index % file_index_refresh_freq == 0) or
-            (file_index == len(file_details))): progressBar.updateBar(fractionCompleted=file_index/len(file_details), counterCurrentValue=file_index)
-        file_index += 1
+                heapq.heappush(transfers_queue, (-size, relative_path, checksum_value))
+        while ((len(pending_tasks) > 0) or (len(transfers_queue) > 0)):
+            while ((n_transfers_in_flight < max_parallel_transfers) and (len(transfers_queue) > 0)):
+                negative_size, relative_path, checksum_value = heapq.heappop(transfers_queue)
+                if print_verbose: print("Copying: {r}".format(r=relative_path))
+                pending_tasks[transfers_pool.submit(CopyFromRemote, xrd_prefix_remote, remote_path_without_xrd_prefix, path_local, relative_path, streams_per_transfer)] = ("transfer", relative_path, -negative_size, checksum_value)
+                n_transfers_in_flight += 1
+            completed_tasks, not_yet_completed_tasks = concurrent.futures.wait(list(pending_tasks.keys()), return_when=concurrent.futures.FIRST_COMPLETED)
+            for completed_task in completed_tasks:
+                task_type, relative_path, size, checksum_value = pending_tasks.pop(completed_task)
+                local_file_path = "{o}/{r}".format(o=path_local, r=relative_path)
+                if (task_type == "precheck"):
+                    if (completed_task.result() == checksum_value):
+                        if print_verbose: print("File {f} already exists and has the right checksum. Skipping!".format(f=local_file_path))
+                        mark_finished(relative_path, size, checksum_value, record_in_journal=True)
+                    else:
+                        if print_verbose: print("File {f} has the wrong checksum. Copying...".format(f=local_file_path))
+                        heapq.heappush(transfers_queue, (-size, relative_path, checksum_value))
+                elif (task_type == "transfer"):
+                    completed_task.result() # raises if xrdcp failed
+                    n_transfers_in_flight -= 1
+                    pending_tasks[checksums_pool.submit(GetLocal_adler32, local_file_path)] = ("verify", relative_path, size, checksum_value)
+                else: # "verify"
+                    if (not(checksum_value == completed_task.result())): sys.exit("ERROR: Checksums do not match after copying file with relative path: {p}".format(p=relative_path))
+                    mark_finished(relative_path, size, checksum_value, record_in_journal=True)
+    finally:
+        for pending_task in pending_tasks:
+            pending_task.cancel()
+        transfers_pool.shutdown(wait=True)
+        checksums_pool.shutdown(wait=True)
+        journal_file_handle.close()
     progressBar.terminate()
 
 def test():